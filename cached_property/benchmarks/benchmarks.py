@@ -0,0 +1,23 @@
+from cached_property import cached_property
+
+
+class C:
+    @cached_property
+    def x(self):
+        return 1
+
+
+c = C()
+c.x
+
+
+def bench_first_access():
+    C().x
+
+
+def bench_cached_access():
+    c.x
+
+
+def bench_class_access():
+    C.x
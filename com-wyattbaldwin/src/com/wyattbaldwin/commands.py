@@ -1,2 +1,3 @@
 from .make_package import make_package
+from .run_all_tests import run_all_tests
 from .run_tests import run_tests
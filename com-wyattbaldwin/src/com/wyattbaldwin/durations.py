@@ -0,0 +1,95 @@
+import json
+import os
+import statistics
+import time
+
+from .impact import STATE_DIR
+
+
+class DurationHistory:
+    """History of test durations across runs.
+
+    The durations of the last few passing runs of each test are kept,
+    along with a summary of each run of the suite, so it's possible to
+    see when a test--or the suite as a whole--has gotten slower. The
+    history is also used to balance tests across worker processes.
+
+    """
+
+    path = STATE_DIR / "durations.json"
+    version = 1
+
+    # Number of durations to keep per test
+    max_samples = 10
+
+    # Number of suite runs to keep
+    max_runs = 100
+
+    def __init__(self, tests=None, runs=None):
+        # {test ID: [duration, ...]} (oldest first)
+        self.tests = tests or {}
+        # [{"timestamp", "tests_run", "duration"}, ...] (oldest first)
+        self.runs = runs or []
+
+    @classmethod
+    def load(cls):
+        try:
+            with cls.path.open() as fp:
+                data = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return cls()
+        if data.get("version") != cls.version:
+            return cls()
+        return cls(data["tests"], data["runs"])
+
+    def save(self):
+        self.path.parent.mkdir(exist_ok=True)
+        data = {"version": self.version, "tests": self.tests, "runs": self.runs}
+        temp_path = self.path.with_suffix(".tmp")
+        with temp_path.open("w") as fp:
+            json.dump(data, fp, indent=2)
+        os.replace(temp_path, self.path)
+
+    def get_median(self, test_id):
+        """Get median duration of test; returns ``None`` if unknown."""
+        samples = self.tests.get(test_id)
+        if not samples:
+            return None
+        return statistics.median(samples)
+
+    def add_run(self, durations, duration):
+        """Add durations of passing tests and summary of suite run."""
+        for test_id, test_duration in durations.items():
+            samples = self.tests.setdefault(test_id, [])
+            samples.append(round(test_duration, 6))
+            del samples[: -self.max_samples]
+        self.runs.append(
+            {
+                "timestamp": round(time.time(), 3),
+                "tests_run": len(durations),
+                "duration": round(duration, 6),
+            }
+        )
+        del self.runs[: -self.max_runs]
+
+
+def print_slowest(stream, durations, history, count):
+    """Print the ``count`` slowest tests.
+
+    Each test's duration is compared to its median duration from
+    previous runs, if it has any, to make slowdowns easy to spot.
+
+    """
+    slowest = sorted(durations.items(), key=lambda item: item[1], reverse=True)
+    slowest = slowest[:count]
+    if not slowest:
+        return
+    stream.write(f"\nSlowest {len(slowest)} tests:\n")
+    for test_id, duration in slowest:
+        line = f"{duration:8.3f}s {test_id}"
+        median = history.get_median(test_id)
+        if median:
+            change = (duration - median) / median * 100
+            line = f"{line} ({change:+.0f}% vs. median {median:.3f}s)"
+        stream.write(f"{line}\n")
+    stream.flush()
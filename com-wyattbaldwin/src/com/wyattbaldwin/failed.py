@@ -0,0 +1,73 @@
+import json
+import os
+
+from .impact import STATE_DIR
+
+
+class FailedTests:
+    """IDs of the tests that failed or errored on the last run.
+
+    Tests that weren't run (e.g., because only affected tests were run
+    or because the run stopped at the first failure) keep their status
+    from previous runs.
+
+    """
+
+    path = STATE_DIR / "failed.json"
+
+    def __init__(self, ids=()):
+        self.ids = set(ids)
+
+    @classmethod
+    def load(cls):
+        try:
+            with cls.path.open() as fp:
+                return cls(json.load(fp))
+        except (FileNotFoundError, ValueError):
+            return cls()
+
+    def save(self):
+        self.path.parent.mkdir(exist_ok=True)
+        temp_path = self.path.with_suffix(".tmp")
+        with temp_path.open("w") as fp:
+            json.dump(sorted(self.ids), fp, indent=2)
+        os.replace(temp_path, self.path)
+
+    def update(self, run_ids, failed_ids):
+        self.ids = (self.ids - set(run_ids)) | set(failed_ids)
+
+    def sort(self, tests):
+        """Sort ``(module, test)`` pairs so failed tests run first.
+
+        Tests are kept grouped by module and test case class so that
+        module and class fixtures (``setUpModule``, ``setUpClass``) are
+        still only run once. Modules containing failed tests come first,
+        then, within each module, classes containing failed tests, then,
+        within each class, the failed tests. The order is otherwise
+        unchanged.
+
+        """
+        failed_modules = set()
+        failed_classes = set()
+        module_index = {}
+        class_index = {}
+        for _, test in tests:
+            cls = type(test)
+            module_index.setdefault(cls.__module__, len(module_index))
+            class_index.setdefault(cls, len(class_index))
+            if test.id() in self.ids:
+                failed_modules.add(cls.__module__)
+                failed_classes.add(cls)
+
+        def key(item):
+            test = item[1]
+            cls = type(test)
+            return (
+                cls.__module__ not in failed_modules,
+                module_index[cls.__module__],
+                cls not in failed_classes,
+                class_index[cls],
+                test.id() not in self.ids,
+            )
+
+        return sorted(tests, key=key)
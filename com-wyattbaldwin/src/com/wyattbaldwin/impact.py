@@ -0,0 +1,195 @@
+import json
+import os
+import pathlib
+import sys
+from collections import defaultdict
+
+STATE_DIR = pathlib.Path(".run-tests")
+
+# Changes to these invalidate the whole map (e.g., dependency updates)
+PROJECT_FILES = ("pyproject.toml", "poetry.lock", "setup.py", "setup.cfg")
+
+# Non-Python files in these directories (e.g., test fixtures) aren't
+# measured by coverage; any change to them causes all tests to be run
+DATA_DIRS = ("src", "tests")
+
+
+class ImpactMap:
+    """Map of test IDs to the files each test executed.
+
+    The map is built from coverage data recorded with a separate
+    coverage context per test. Along with the files each test executed,
+    the mtime and size of every file are recorded so that changed files
+    can be detected on the next run without hashing anything.
+
+    A test is affected by a change if it's new (i.e., not in the map) or
+    if any file it executed, including its own test module, has changed
+    since the map was saved.
+
+    Module-level code runs at import time, outside of any test's
+    context, so it can't be attributed to particular tests. Instead, all
+    tests are selected if a file that was *only* executed at import time
+    (e.g., a module of constants) changes or if a non-Python file in
+    ``src/`` or ``tests/`` (e.g., a fixture) is added, removed, or
+    changed.
+
+    """
+
+    path = STATE_DIR / "impact.json"
+    version = 2
+
+    def __init__(
+        self, files=None, project=None, tests=None, imported=None, data_files=None
+    ):
+        # {path: [mtime_ns, size]}
+        self.files = files or {}
+        # {path: [mtime_ns, size] | None} for project files
+        self.project = project or get_stats(PROJECT_FILES)
+        # {test ID: [path, ...]}
+        self.tests = tests or {}
+        # [path, ...] for files executed at import time
+        self.imported = imported or []
+        # {path: [mtime_ns, size]} for non-Python files in DATA_DIRS
+        self.data_files = data_files or {}
+
+    @classmethod
+    def load(cls):
+        """Load map; returns ``None`` if it's missing or stale."""
+        try:
+            with cls.path.open() as fp:
+                data = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return None
+        if data.get("version") != cls.version:
+            return None
+        if data["project"] != get_stats(PROJECT_FILES):
+            return None
+        return cls(
+            data["files"],
+            data["project"],
+            data["tests"],
+            data["imported"],
+            data["data_files"],
+        )
+
+    def save(self):
+        self.path.parent.mkdir(exist_ok=True)
+        data = {
+            "version": self.version,
+            "files": self.files,
+            "project": self.project,
+            "tests": self.tests,
+            "imported": self.imported,
+            "data_files": self.data_files,
+        }
+        temp_path = self.path.with_suffix(".tmp")
+        with temp_path.open("w") as fp:
+            json.dump(data, fp)
+        os.replace(temp_path, self.path)
+
+    def get_changed_files(self):
+        return {path for path, stat in self.files.items() if get_stat(path) != stat}
+
+    def select(self, tests):
+        """Select the tests affected by changes since the map was saved."""
+        changed = self.get_changed_files()
+        if not changed.isdisjoint(self.get_import_only_files()):
+            return list(tests)
+        if get_stats(find_data_files()) != self.data_files:
+            return list(tests)
+        selected = []
+        for test in tests:
+            files = self.tests.get(test.id())
+            if files is None or not changed.isdisjoint(files):
+                selected.append(test)
+        return selected
+
+    def get_import_only_files(self):
+        """Get files that weren't executed by any test."""
+        executed = {path for files in self.tests.values() for path in files}
+        return set(self.imported) - executed
+
+    def update(self, tests, coverage_data):
+        """Update map from a successful run of ``tests``.
+
+        Entries for tests that weren't run are kept; entries for tests
+        that no longer exist are dropped.
+
+        """
+        files_by_test = get_files_by_test(coverage_data)
+        # In parallel runs, only the selected tests' modules are imported,
+        # so files imported on earlier runs are kept.
+        imported = set(self.imported) | files_by_test.pop("", set())
+        self.imported = sorted(path for path in imported if os.path.exists(path))
+        for test in tests:
+            test_id = test.id()
+            files = files_by_test.get(test_id, set())
+            module_file = get_test_module_file(test)
+            if module_file:
+                files.add(module_file)
+            self.tests[test_id] = sorted(files)
+        self.files = {}
+        for files in self.tests.values():
+            for path in files:
+                if path not in self.files:
+                    self.files[path] = get_stat(path)
+        for path in self.imported:
+            if path not in self.files:
+                self.files[path] = get_stat(path)
+        self.data_files = get_stats(find_data_files())
+        self.project = get_stats(PROJECT_FILES)
+
+    def prune(self, test_ids):
+        self.tests = {t: f for t, f in self.tests.items() if t in test_ids}
+
+
+def get_files_by_test(coverage_data):
+    """Get the files executed by each test from coverage contexts.
+
+    Files executed at import time are under the empty context.
+
+    """
+    files_by_test = defaultdict(set)
+    for file in coverage_data.measured_files():
+        path = os.path.relpath(file)
+        contexts_by_lineno = coverage_data.contexts_by_lineno(file)
+        for contexts in contexts_by_lineno.values():
+            for context in contexts:
+                files_by_test[context].add(path)
+    return files_by_test
+
+
+def find_data_files(dirs=DATA_DIRS):
+    """Find non-Python files, skipping bytecode caches and egg info."""
+    paths = []
+    for dir in dirs:
+        for path in sorted(pathlib.Path(dir).rglob("*")):
+            if path.suffix in (".py", ".pyc") or not path.is_file():
+                continue
+            if any(p == "__pycache__" or p.endswith(".egg-info") for p in path.parts):
+                continue
+            paths.append(str(path))
+    return paths
+
+
+def get_test_module_file(test):
+    module = sys.modules.get(type(test).__module__)
+    file = getattr(module, "__file__", None)
+    if file is None:
+        return None
+    path = os.path.relpath(file)
+    if path.startswith(os.pardir):
+        return None
+    return path
+
+
+def get_stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def get_stats(paths):
+    return {path: get_stat(path) for path in paths}
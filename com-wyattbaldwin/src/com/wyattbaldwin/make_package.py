@@ -33,6 +33,7 @@ black = { version = "*", allow-prereleases = true }
 coverage = "*"
 
 [tool.make-release.args]
+benchmark = true
 merge = false
 tag-name = "{name}-{version}"
 
@@ -51,6 +52,12 @@ ${description}
 
     >>> import ${name}
 
+## Benchmarks
+
+Benchmarks are `bench_*` functions in `benchmarks/bench*.py`. Run them
+with `python benchmarks/run.py`; results are written to
+`benchmarks/results/<commit>.json`.
+
 """
 
 
@@ -82,6 +89,195 @@ class Tests(unittest.TestCase):
 """
 
 
+BENCHMARKS_TEMPLATE = """\
+import ${name}
+
+
+def bench_version():
+    ${name}.__version__
+"""
+
+
+BENCHMARK_RUNNER_TEMPLATE = """\
+\"\"\"Run benchmarks and write the results for the current commit.
+
+Benchmarks are functions named ``bench_*`` in modules named ``bench*.py``
+in this directory.
+
+Each benchmark is called in a loop that's calibrated so that one pass
+takes at least ``--min-time`` seconds. After ``--warmup`` passes whose
+timings are discarded, ``--repetitions`` passes are timed, and the mean,
+standard deviation, min, and max time per call are computed from them.
+
+Results are written as JSON to ``results/<commit>.json``::
+
+    {
+        "commit": "<SHA>",
+        "benchmarks": {
+            "<module>.<function>": {
+                "mean": <seconds>,
+                "stdev": <seconds>,
+                "min": <seconds>,
+                "max": <seconds>,
+                "repetitions": <count>,
+                "number": <calls per repetition>,
+                "samples": [<seconds>, ...]
+            }
+        }
+    }
+
+If the working tree has uncommitted changes, "-dirty" is appended to the
+commit SHA.
+
+\"\"\"
+
+import argparse
+import importlib.util
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARKS_DIR = pathlib.Path(__file__).resolve().parent
+RESULTS_DIR = BENCHMARKS_DIR / "results"
+
+# Benchmark the code in the working tree, even if it isn't installed
+sys.path.insert(0, str(BENCHMARKS_DIR.parent / "src"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run benchmarks")
+    parser.add_argument(
+        "-k",
+        "--filter",
+        help="Only run benchmarks with names that contain this string",
+    )
+    parser.add_argument("-r", "--repetitions", type=int, default=10)
+    parser.add_argument("-w", "--warmup", type=int, default=2)
+    parser.add_argument(
+        "-t",
+        "--min-time",
+        type=float,
+        default=0.05,
+        help="Minimum time for each repetition in seconds",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Write results here instead of results/<commit>.json",
+    )
+    args = parser.parse_args(argv)
+
+    benchmarks = discover_benchmarks(args.filter)
+    if not benchmarks:
+        print("No benchmarks found", file=sys.stderr)
+        return 1
+
+    commit = get_commit()
+    results = {}
+    width = max(len(name) for name, _ in benchmarks)
+    for name, func in benchmarks:
+        stats = run_benchmark(func, args.repetitions, args.warmup, args.min_time)
+        results[name] = stats
+        print(
+            f"{name:<{width}}  "
+            f"mean {format_time(stats['mean'])}  "
+            f"stdev {format_time(stats['stdev'])}  "
+            f"min {format_time(stats['min'])}"
+        )
+
+    if args.output:
+        output = pathlib.Path(args.output)
+    else:
+        output = RESULTS_DIR / f"{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open("w") as fp:
+        json.dump({"commit": commit, "benchmarks": results}, fp, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+def discover_benchmarks(filter=None):
+    benchmarks = []
+    for path in sorted(BENCHMARKS_DIR.glob("bench*.py")):
+        spec = importlib.util.spec_from_file_location(path.stem, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        for attr in sorted(vars(module)):
+            func = getattr(module, attr)
+            if attr.startswith("bench_") and callable(func):
+                name = f"{path.stem}.{attr}"
+                if filter is None or filter in name:
+                    benchmarks.append((name, func))
+    return benchmarks
+
+
+def run_benchmark(func, repetitions, warmup, min_time):
+    number = calibrate(func, min_time)
+    for _ in range(warmup):
+        time_loop(func, number)
+    samples = [time_loop(func, number) / number for _ in range(repetitions)]
+    return {
+        "mean": statistics.mean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "min": min(samples),
+        "max": max(samples),
+        "repetitions": repetitions,
+        "number": number,
+        "samples": samples,
+    }
+
+
+def calibrate(func, min_time):
+    \"\"\"Get number of calls needed for one loop to take ``min_time``.\"\"\"
+    number = 1
+    while time_loop(func, number) < min_time:
+        number *= 2
+    return number
+
+
+def time_loop(func, number):
+    start_time = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start_time
+
+
+def get_commit():
+    def git(*args):
+        return subprocess.run(
+            ("git", *args),
+            cwd=BENCHMARKS_DIR,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+
+    result = git("rev-parse", "HEAD")
+    if result.returncode:
+        return "unknown"
+    commit = result.stdout.strip()
+    # Check the whole package, not just the benchmarks
+    package_dir = str(BENCHMARKS_DIR.parent)
+    if git("status", "--porcelain", "--untracked-files=no", package_dir).stdout.strip():
+        commit = f"{commit}-dirty"
+    return commit
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e3), ("us", 1e6)):
+        if seconds >= 1 / scale:
+            return f"{seconds * scale:7.3f} {unit}"
+    return f"{seconds * 1e9:7.3f} ns"
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+"""
+
+
 @command
 def make_package(
     name: arg(help="Package name"),
@@ -118,6 +314,10 @@ def make_package(
     tests_dir = package_dir.joinpath("tests")
     tests_path = tests_dir / "tests.py"
 
+    benchmarks_dir = package_dir.joinpath("benchmarks")
+    benchmarks_path = benchmarks_dir / "benchmarks.py"
+    benchmark_runner_path = benchmarks_dir / "run.py"
+
     template_vars = {
         "name": name,
         "qualified_name": qualified_name,
@@ -133,6 +333,7 @@ def make_package(
     print(f"Package directory: {package_dir.absolute()}")
     print(f"Source directory: {src_dir.absolute()}")
     print(f"Test directory: {tests_dir.absolute()}")
+    print(f"Benchmarks directory: {benchmarks_dir.absolute()}")
 
     try:
         result = subprocess.run(
@@ -180,6 +381,12 @@ def make_package(
     create_dir(tests_dir)
     create_file(tests_path, TESTS_TEMPLATE, template_vars)
 
+    # Benchmarks ----------------------------------------------------------------------
+
+    create_dir(benchmarks_dir)
+    create_file(benchmarks_path, BENCHMARKS_TEMPLATE, template_vars)
+    create_file(benchmark_runner_path, BENCHMARK_RUNNER_TEMPLATE, template_vars)
+
     return 0
 
 
@@ -0,0 +1,172 @@
+import os
+import pathlib
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from runcommands.args import arg
+from runcommands.command import command
+from runcommands.util import abort, printer
+
+# E.g.: TOTAL    1033    368    64%
+COVERAGE_TOTAL_RE = re.compile(r"^TOTAL\s.*?(?P<percent>\d+(?:\.\d+)?%)\s*$")
+
+
+@command
+def run_all_tests(
+    *packages,
+    jobs: arg(
+        short_option="-j",
+        type=int,
+        help="Test this many packages at once; 0 means all at once",
+    ) = 0,
+    test_command: arg(
+        short_option="-t",
+        help="Command used to run each package's tests",
+    ) = "poetry run run-tests",
+    test_args: arg(
+        short_option="-a",
+        help="Additional args for the test command (e.g., -a='-C -j 0')",
+    ) = "",
+):
+    """Run the tests for all packages in the repo concurrently.
+
+    Packages are the top level directories in the repo that contain a
+    ``pyproject.toml`` and a ``tests`` directory. Pass package directory
+    names to test only those packages.
+
+    Each package's tests are run in a separate subprocess, using the
+    package's own environment, with output prefixed by the package name.
+    A summary of the results and coverage of each package is shown at
+    the end.
+
+    """
+    root = get_repo_root()
+    package_dirs = discover_packages(root)
+    if packages:
+        unknown = set(packages) - {path.name for path in package_dirs}
+        if unknown:
+            abort(1, f"Unknown package(s): {', '.join(sorted(unknown))}")
+        package_dirs = [path for path in package_dirs if path.name in packages]
+    if not package_dirs:
+        abort(1, f"No packages with tests found in {root}")
+
+    argv = shlex.split(test_command) + shlex.split(test_args)
+    width = max(len(path.name) for path in package_dirs)
+    lock = threading.Lock()
+    start_time = time.perf_counter()
+
+    max_workers = jobs or len(package_dirs)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(run_package_tests, path, argv, width, lock)
+            for path in package_dirs
+        ]
+        results = [future.result() for future in futures]
+
+    elapsed = time.perf_counter() - start_time
+    print_summary(results, width, elapsed)
+    if any(result["return_code"] for result in results):
+        return 1
+    return 0
+
+
+def get_repo_root():
+    result = subprocess.run(
+        ("git", "rev-parse", "--show-toplevel"),
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    return pathlib.Path(result.stdout.strip())
+
+
+def discover_packages(root):
+    return [
+        path
+        for path in sorted(root.iterdir())
+        if (path / "pyproject.toml").is_file() and (path / "tests").is_dir()
+    ]
+
+
+def get_package_env():
+    """Get environment for running a package's tests.
+
+    The current virtualenv is removed from the environment so that each
+    package's tests are run in the package's own virtualenv.
+
+    """
+    env = os.environ.copy()
+    virtual_env = env.pop("VIRTUAL_ENV", None)
+    env.pop("POETRY_ACTIVE", None)
+    env.pop("PYTHONHOME", None)
+    if virtual_env:
+        bin_dir = os.path.join(virtual_env, "bin")
+        path = env.get("PATH", "").split(os.pathsep)
+        env["PATH"] = os.pathsep.join(p for p in path if p != bin_dir)
+    env["PYTHONUNBUFFERED"] = "1"
+    return env
+
+
+def run_package_tests(path, argv, width, lock):
+    """Run a package's tests, streaming prefixed output as it arrives."""
+    name = path.name
+    prefix = f"{name:<{width}} |"
+    coverage = None
+    start_time = time.perf_counter()
+    try:
+        process = subprocess.Popen(
+            argv,
+            cwd=path,
+            env=get_package_env(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+    except OSError as exc:
+        with lock:
+            printer.error(prefix, f"Could not run {argv[0]}: {exc}")
+        return_code = 127
+    else:
+        for line in process.stdout:
+            line = line.rstrip()
+            match = COVERAGE_TOTAL_RE.search(line)
+            if match:
+                coverage = match.group("percent")
+            with lock:
+                print(prefix, line, flush=True)
+        return_code = process.wait()
+    return {
+        "name": name,
+        "return_code": return_code,
+        "duration": time.perf_counter() - start_time,
+        "coverage": coverage,
+    }
+
+
+def print_summary(results, width, elapsed):
+    printer.header("Summary")
+    for result in results:
+        status = "FAIL" if result["return_code"] else "ok"
+        line = (
+            f"{result['name']:<{width}}  {status:<4}  {result['duration']:7.2f}s"
+            f"  coverage: {result['coverage'] or '-'}"
+        )
+        if result["return_code"]:
+            printer.error(line)
+        else:
+            printer.success(line)
+    failed = sum(1 for result in results if result["return_code"])
+    msg = f"Tested {len(results)} packages in {elapsed:.2f}s"
+    if failed:
+        printer.error(f"{msg}; {failed} failed")
+    else:
+        printer.success(f"{msg}; all passed")
+
+
+if __name__ == "__main__":
+    sys.exit(run_all_tests.console_script())
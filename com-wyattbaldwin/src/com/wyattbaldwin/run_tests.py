@@ -1,9 +1,23 @@
+import functools
+import io
+import multiprocessing
+import os
+import pathlib
 import sys
+import tempfile
+import time
 import unittest
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from coverage import Coverage
 from runcommands.args import arg
 from runcommands.command import command
+from runcommands.util import printer
+
+from .durations import DurationHistory, print_slowest
+from .failed import FailedTests
+from .impact import ImpactMap
+from .watch import run_on_change
 
 
 @command
@@ -13,18 +27,420 @@ def run_tests(
         inverse_short_option="-C",
         help="With coverage",
     ) = True,
+    jobs: arg(
+        short_option="-j",
+        type=int,
+        help="Run test modules in this many processes; 0 means one per CPU",
+    ) = 1,
+    incremental: arg(
+        short_option="-i",
+        help="Only run tests affected by changes since the last passing run",
+    ) = False,
+    slowest: arg(
+        short_option="-s",
+        type=int,
+        help="Show this many of the slowest tests; 0 to disable",
+    ) = 10,
+    watch: arg(
+        short_option="-w",
+        help="Watch src/ and tests/ and rerun affected tests on changes",
+    ) = False,
+    fail_fast: arg(
+        short_option="-f",
+        help="Stop at the first failure or error and skip coverage report",
+    ) = False,
 ):
-    runner = unittest.TextTestRunner()
-    loader = unittest.TestLoader()
-    if with_coverage:
+    """Run tests, optionally in parallel and/or incrementally.
+
+    Whenever coverage is measured, the files executed by each test are
+    recorded in an impact map in ``.run-tests/``. With ``--incremental``,
+    the map is used to select only the tests affected by changes since
+    the last passing run. All tests are run if the map is missing or
+    stale. The map is only updated when all the selected tests pass, so
+    tests that fail will be selected again on the next run.
+
+    Module-level code (imports, constants, class and function
+    definitions) runs when a module is imported rather than during any
+    particular test, so it isn't attributed to any test. When a file
+    that was only executed at import time changes, or when a non-Python
+    file such as a fixture changes, all tests are run.
+
+    The duration of every test is recorded too. The slowest tests are
+    shown after the run, and the durations of passing tests are added to
+    a history in ``.run-tests/``, which is used to start the slowest
+    tests first when running in parallel.
+
+    Tests that failed on the last run are run first, so the tests being
+    fixed give feedback right away (especially with ``--fail-fast``).
+
+    With ``--watch``, tests are run incrementally in a child process
+    each time a file in ``src/`` or ``tests/`` changes. Children are
+    forked from a warm parent that has already imported everything the
+    tests need except the code under test.
+
+    """
+    if watch:
+        run = functools.partial(
+            run_tests,
+            with_coverage=with_coverage,
+            jobs=jobs,
+            incremental=True,
+            slowest=slowest,
+            fail_fast=fail_fast,
+        )
+        argv = [
+            sys.executable,
+            "-m",
+            "com.wyattbaldwin.run_tests",
+            "--incremental",
+            "-c" if with_coverage else "-C",
+            f"--jobs={jobs}",
+            f"--slowest={slowest}",
+        ]
+        if fail_fast:
+            argv.append("--fail-fast")
+        return run_on_change(run, argv)
+
+    start_dir = "./tests"
+    measure = with_coverage or incremental
+
+    # In serial mode, coverage has to be started before the tests are
+    # loaded so that module-level code is measured.
+    coverage = None
+    if measure and jobs == 1:
         coverage = Coverage(source=["./src"])
         coverage.start()
-    tests = loader.discover("./tests")
-    result = runner.run(tests)
+
+    if jobs != 1:
+        modules = discover_test_modules(start_dir)
+        tests = [
+            (module, test)
+            for module in modules
+            for test in load_tests(module, start_dir)
+        ]
+    else:
+        loader = unittest.TestLoader()
+        tests = [(None, test) for test in iter_tests(loader.discover(start_dir))]
+
+    failed = FailedTests.load()
+    impact_map = ImpactMap.load() if measure else None
+    selected = tests
+    if incremental:
+        if impact_map is None:
+            printer.warning("Test impact map is missing or stale; running all tests")
+        else:
+            selected_tests = impact_map.select(test for _, test in tests)
+            # Tests that failed last time are always run again
+            selected_ids = {test.id() for test in selected_tests} | failed.ids
+            selected = [item for item in tests if item[1].id() in selected_ids]
+            if not selected:
+                if coverage is not None:
+                    coverage.stop()
+                printer.success("No tests affected by changes")
+                return
+            printer.info(
+                f"Running {len(selected)} of {len(tests)} tests affected by changes"
+            )
+
+    # Run tests that failed last time first
+    selected = failed.sort(selected)
+
+    history = DurationHistory.load()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        start_time = time.perf_counter()
+        if jobs != 1:
+            jobs = jobs or os.cpu_count() or 1
+            result, coverage = run_tests_in_parallel(
+                selected, measure, jobs, start_dir, data_dir, history, failed, fail_fast
+            )
+        else:
+            result = run_tests_serially(selected, coverage, fail_fast)
+        elapsed = time.perf_counter() - start_time
+
+        if slowest:
+            print_slowest(sys.stderr, result.test_durations, history, slowest)
+        not_passed = {
+            get_test_id(test)
+            for test, _ in result.failures + result.errors + result.skipped
+        }
+        history.add_run(
+            {
+                test_id: duration
+                for test_id, duration in result.test_durations.items()
+                if test_id not in not_passed
+            },
+            elapsed,
+        )
+        history.save()
+
+        failed.update(
+            result.test_durations,
+            (get_test_id(test) for test, _ in result.failures + result.errors),
+        )
+        failed.save()
+
+        if coverage is not None:
+            if result.wasSuccessful():
+                impact_map = impact_map or ImpactMap()
+                impact_map.prune({test.id() for _, test in tests})
+                impact_map.update([test for _, test in selected], coverage.get_data())
+                impact_map.save()
+            if fail_fast and not result.wasSuccessful():
+                printer.warning("Skipping coverage report due to failure")
+            elif with_coverage and not result.errors:
+                if len(selected) < len(tests):
+                    printer.warning("Skipping coverage report for partial run")
+                else:
+                    coverage.report()
+
+    return 0 if result.wasSuccessful() else 1
+
+
+def run_tests_serially(tests, coverage=None, fail_fast=False):
+    resultclass = functools.partial(TestResult, coverage=coverage)
+    runner = unittest.TextTestRunner(resultclass=resultclass, failfast=fail_fast)
+    result = runner.run(unittest.TestSuite(test for _, test in tests))
+    if coverage is not None:
+        coverage.stop()
+    return result
+
+
+def run_tests_in_parallel(
+    tests, with_coverage, jobs, start_dir, data_dir, history, failed, fail_fast=False
+):
+    """Run test modules in worker processes.
+
+    Test modules are split into units--one per test case class, plus
+    one for any other tests in the module, such as doctests--and each
+    unit is run in one of ``jobs`` worker processes. When coverage is
+    enabled, each worker writes its own coverage data file, and the data
+    files are combined into a single report at the end.
+
+    Worker processes are spawned rather than forked so that modules are
+    imported after coverage is started.
+
+    Units containing tests that failed last time are started first.
+    Otherwise, units are started slowest first according to the duration
+    history, so a slow unit doesn't end up running alone at the end.
+    Units with tests that aren't in the history are started before all
+    others.
+
+    With ``fail_fast``, units that haven't started yet are cancelled as
+    soon as a unit fails.
+
+    """
+    units = {}
+    for module, test in tests:
+        unit = get_test_unit(module, test)
+        units.setdefault(unit, []).append(test.id())
+    units = sorted(
+        units.items(),
+        key=lambda item: (
+            not failed.ids.isdisjoint(item[1]),
+            get_expected_duration(item[1], history),
+        ),
+        reverse=True,
+    )
+    context = multiprocessing.get_context("spawn")
+    stream = sys.stderr
+    result = TestResult(stream, False, 0)
+    data_file = os.path.join(data_dir, ".coverage") if with_coverage else None
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(jobs, mp_context=context) as executor:
+        futures = [
+            executor.submit(
+                run_test_unit, unit, test_ids, start_dir, data_file, fail_fast
+            )
+            for unit, test_ids in units
+        ]
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            unit_result = future.result()
+            result.testsRun += unit_result["tests_run"]
+            result.failures.extend(unit_result["failures"])
+            result.errors.extend(unit_result["errors"])
+            result.skipped.extend(unit_result["skipped"])
+            result.test_durations.update(unit_result["durations"])
+            if unit_result["failures"] or unit_result["errors"]:
+                status = "FAIL"
+            else:
+                status = "ok"
+            stream.write(
+                f"{unit_result['name']} ... {status} "
+                f"({unit_result['tests_run']} tests)\n"
+            )
+            if fail_fast and status == "FAIL":
+                for other_future in futures:
+                    other_future.cancel()
+    elapsed = time.perf_counter() - start_time
+
+    for flavor, items in (("ERROR", result.errors), ("FAIL", result.failures)):
+        for test_id, traceback in items:
+            stream.write("=" * 70 + "\n")
+            stream.write(f"{flavor}: {test_id}\n")
+            stream.write("-" * 70 + "\n")
+            stream.write(f"{traceback}\n")
+
+    stream.write("-" * 70 + "\n")
+    stream.write(f"Ran {result.testsRun} tests in {elapsed:.3f}s\n\n")
+    if result.wasSuccessful():
+        skipped = len(result.skipped)
+        stream.write("OK" + (f" (skipped={skipped})" if skipped else "") + "\n")
+    else:
+        failures, errors = len(result.failures), len(result.errors)
+        stream.write(f"FAILED (failures={failures}, errors={errors})\n")
+    stream.flush()
+
+    coverage = None
     if with_coverage:
+        coverage = Coverage(source=["./src"], data_file=data_file)
+        coverage.combine([data_dir])
+    return result, coverage
+
+
+def get_expected_duration(test_ids, history):
+    total = 0
+    for test_id in test_ids:
+        median = history.get_median(test_id)
+        if median is None:
+            return float("inf")
+        total += median
+    return total
+
+
+def get_test_id(test):
+    # Results from worker processes have test IDs instead of tests
+    return test if isinstance(test, str) else test.id()
+
+
+class TestResult(unittest.TextTestResult):
+    """Test result that records the duration and coverage of each test.
+
+    Each test is run in its own coverage context, named by its test ID,
+    so the coverage data shows which lines each test executed.
+
+    """
+
+    def __init__(self, *args, coverage=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.coverage = coverage
+        # {test ID: duration in seconds}
+        self.test_durations = {}
+        self._start_times = {}
+
+    def startTest(self, test):
+        if self.coverage is not None:
+            self.coverage.switch_context(test.id())
+        super().startTest(test)
+        self._start_times[test.id()] = time.perf_counter()
+
+    def stopTest(self, test):
+        start_time = self._start_times.pop(test.id(), None)
+        if start_time is not None:
+            self.test_durations[test.id()] = time.perf_counter() - start_time
+        super().stopTest(test)
+        if self.coverage is not None:
+            self.coverage.switch_context("")
+
+
+def get_test_unit(module, test):
+    """Get the unit a test belongs to for running in a worker process.
+
+    Each unit is a ``(module name, class name)`` pair. The class name is
+    ``None`` for tests that aren't methods of a test case class defined
+    in the module (e.g., doctests added via ``load_tests``).
+
+    """
+    cls = type(test)
+    if cls.__module__ == module:
+        return module, cls.__qualname__
+    return module, None
+
+
+def load_tests(module, start_dir):
+    """Load tests from module and flatten them into a list."""
+    start_dir = os.path.abspath(start_dir)
+    if start_dir not in sys.path:
+        sys.path.insert(0, start_dir)
+    suite = unittest.TestLoader().loadTestsFromName(module)
+    return list(iter_tests(suite))
+
+
+def iter_tests(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from iter_tests(test)
+        else:
+            yield test
+
+
+def run_test_unit(unit, test_ids, start_dir, data_file=None, fail_fast=False):
+    """Run the specified tests from a unit in worker process.
+
+    The tests are run in the order of ``test_ids``.
+
+    Returns a summary of the results that can be sent back to the parent
+    process.
+
+    """
+    module, class_name = unit
+    coverage = None
+    if data_file:
+        coverage = Coverage(source=["./src"], data_file=data_file, data_suffix=True)
+        coverage.start()
+    order = {test_id: i for i, test_id in enumerate(test_ids)}
+    tests = [
+        test
+        for test in load_tests(module, start_dir)
+        if get_test_unit(module, test) == unit and test.id() in order
+    ]
+    tests.sort(key=lambda test: order[test.id()])
+    resultclass = functools.partial(TestResult, coverage=coverage)
+    runner = unittest.TextTestRunner(
+        stream=io.StringIO(), resultclass=resultclass, failfast=fail_fast
+    )
+    result = runner.run(unittest.TestSuite(tests))
+    if coverage is not None:
         coverage.stop()
-        if not result.errors:
-            coverage.report()
+        coverage.save()
+    return {
+        "name": module if class_name is None else f"{module}.{class_name}",
+        "tests_run": result.testsRun,
+        "failures": [(test.id(), traceback) for test, traceback in result.failures],
+        "errors": [(test.id(), traceback) for test, traceback in result.errors],
+        "skipped": [(test.id(), reason) for test, reason in result.skipped],
+        "durations": result.test_durations,
+    }
+
+
+def discover_test_modules(start_dir, pattern="test*.py"):
+    """Find test modules like ``unittest discover`` does.
+
+    Modules in subdirectories are only found if every directory between
+    ``start_dir`` and the module is a package. Module names are relative
+    to ``start_dir``.
+
+    .. note:: This is duplicated in ``make_release.shard``, which has to
+        be importable without this package. Keep the two in sync.
+
+    """
+    start_dir = pathlib.Path(start_dir)
+    names = []
+    for path in sorted(start_dir.rglob(pattern)):
+        parts = path.relative_to(start_dir).parts
+        if not all(part.isidentifier() for part in parts[:-1] + (path.stem,)):
+            continue
+        package_dir = start_dir
+        for part in parts[:-1]:
+            package_dir = package_dir / part
+            if not (package_dir / "__init__.py").is_file():
+                break
+        else:
+            names.append(".".join(parts[:-1] + (path.stem,)))
+    return names
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+import traceback
+
+from runcommands.util import printer
+
+WATCH_DIRS = ("src", "tests")
+
+
+def run_on_change(run, argv, dirs=WATCH_DIRS, interval=0.2):
+    """Call ``run`` in a fresh child process whenever files change.
+
+    Python files in ``dirs`` are polled every ``interval`` seconds.
+
+    Where ``os.fork`` is available, this process stays warm: after the
+    first run, the third party and standard library modules imported by
+    the child are imported here too, so subsequent children, which are
+    forked from this process, start with them already imported. Modules
+    in ``dirs`` are never imported here, so children always get the
+    current version of them.
+
+    Otherwise, ``argv`` is run in a subprocess on each change.
+
+    """
+    dirs = [os.path.abspath(d) for d in dirs]
+    can_fork = hasattr(os, "fork")
+    snapshot = get_snapshot(dirs)
+
+    try:
+        if can_fork:
+            modules = run_in_child(run, report_modules_outside=dirs)
+            preload_modules(modules)
+        else:
+            subprocess.run(argv)
+        printer.info(f"Watching {', '.join(os.path.relpath(d) for d in dirs)}...")
+        while True:
+            time.sleep(interval)
+            new_snapshot = get_snapshot(dirs)
+            if new_snapshot == snapshot:
+                continue
+            # Wait until files stop changing so that saving several
+            # files at once only triggers one run.
+            while True:
+                time.sleep(interval)
+                latest_snapshot = get_snapshot(dirs)
+                if latest_snapshot == new_snapshot:
+                    break
+                new_snapshot = latest_snapshot
+            changed = get_changed_paths(snapshot, new_snapshot)
+            snapshot = new_snapshot
+            printer.header("Changed:", ", ".join(changed))
+            if can_fork:
+                run_in_child(run)
+            else:
+                subprocess.run(argv)
+            printer.info("Watching for changes...")
+    except KeyboardInterrupt:
+        return 0
+
+
+def get_snapshot(dirs):
+    """Get mtime and size of every Python file in ``dirs``."""
+    snapshot = {}
+    for top in dirs:
+        for dir_path, dir_names, file_names in os.walk(top):
+            dir_names[:] = [
+                name
+                for name in dir_names
+                if not (name.startswith(".") or name == "__pycache__")
+            ]
+            for name in file_names:
+                if name.endswith(".py"):
+                    path = os.path.join(dir_path, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def get_changed_paths(old, new):
+    paths = {path for path in old.keys() | new.keys() if old.get(path) != new.get(path)}
+    return sorted(os.path.relpath(path) for path in paths)
+
+
+def run_in_child(run, report_modules_outside=None):
+    """Call ``run`` in a forked child process.
+
+    If ``report_modules_outside`` is specified, the names of modules
+    imported by the child that aren't in any of the specified dirs are
+    returned.
+
+    """
+    if report_modules_outside is not None:
+        read_fd, write_fd = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        code = 1
+        try:
+            code = run() or 0
+        except SystemExit as exc:
+            code = exc.code if isinstance(exc.code, int) else 1
+        except KeyboardInterrupt:
+            code = 130
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            if report_modules_outside is not None:
+                os.close(read_fd)
+                modules = get_modules_outside(report_modules_outside)
+                with os.fdopen(write_fd, "w") as fp:
+                    json.dump(modules, fp)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    modules = []
+    if report_modules_outside is not None:
+        os.close(write_fd)
+        with os.fdopen(read_fd) as fp:
+            data = fp.read()
+        if data:
+            modules = json.loads(data)
+    os.waitpid(pid, 0)
+    return modules
+
+
+def get_modules_outside(dirs):
+    """Get names of imported modules that aren't in any of ``dirs``."""
+    dirs = tuple(os.path.join(d, "") for d in dirs)
+    names = []
+    for name, module in list(sys.modules.items()):
+        file = getattr(module, "__file__", None)
+        if name == "__main__" or not file:
+            continue
+        if not os.path.abspath(file).startswith(dirs):
+            names.append(name)
+    return sorted(names)
+
+
+def preload_modules(names):
+    for name in names:
+        if name in sys.modules:
+            continue
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
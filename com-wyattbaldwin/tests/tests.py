@@ -0,0 +1,534 @@
+import io
+import json
+import os
+import pathlib
+import string
+import subprocess
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+from com.wyattbaldwin import (
+    durations,
+    failed,
+    impact,
+    make_package,
+    run_all_tests,
+    run_tests,
+    watch,
+)
+
+SRC_DIR = pathlib.Path(__file__).resolve().parent.parent / "src"
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Run each test in a fresh temporary directory."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.dir = pathlib.Path(self.temp_dir.name)
+        original_dir = os.getcwd()
+        os.chdir(self.dir)
+        self.addCleanup(os.chdir, original_dir)
+
+    def write_file(self, name, content):
+        path = self.dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+        return path
+
+
+class FakeTest:
+    def __init__(self, test_id):
+        self.test_id = test_id
+
+    def id(self):
+        return self.test_id
+
+
+class FakeCoverageData:
+    def __init__(self, contexts_by_file):
+        # {path: {line number: [context, ...]}}
+        self.contexts_by_file = contexts_by_file
+
+    def measured_files(self):
+        return [os.path.abspath(path) for path in self.contexts_by_file]
+
+    def contexts_by_lineno(self, file):
+        return self.contexts_by_file[os.path.relpath(file)]
+
+
+class ImpactMapTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_file("pyproject.toml", "")
+        self.write_file("src/a.py", "a = 1\n")
+        self.write_file("src/b.py", "b = 1\n")
+        self.tests = [FakeTest("test_a"), FakeTest("test_b")]
+        self.coverage_data = FakeCoverageData(
+            {
+                "src/a.py": {1: ["", "test_a"]},
+                "src/b.py": {1: ["", "test_b"]},
+            }
+        )
+        self.impact_map = impact.ImpactMap()
+        self.impact_map.update(self.tests, self.coverage_data)
+
+    def touch(self, name):
+        path = self.dir / name
+        path.write_text(path.read_text() + "# Changed\n")
+
+    def select(self, tests):
+        return [test.id() for test in self.impact_map.select(tests)]
+
+    def test_update(self):
+        self.assertEqual(
+            self.impact_map.tests, {"test_a": ["src/a.py"], "test_b": ["src/b.py"]}
+        )
+        self.assertEqual(sorted(self.impact_map.files), ["src/a.py", "src/b.py"])
+
+    def test_select(self):
+        self.assertEqual(self.select(self.tests), [])
+        self.touch("src/a.py")
+        self.assertEqual(self.select(self.tests), ["test_a"])
+        # New tests are always selected
+        self.assertEqual(
+            self.select(self.tests + [FakeTest("test_c")]), ["test_a", "test_c"]
+        )
+
+    def test_update_keeps_tests_that_were_not_run(self):
+        self.touch("src/a.py")
+        coverage_data = FakeCoverageData({"src/a.py": {1: ["test_a"]}})
+        self.impact_map.update([self.tests[0]], coverage_data)
+        self.assertEqual(
+            self.impact_map.tests, {"test_a": ["src/a.py"], "test_b": ["src/b.py"]}
+        )
+        self.assertEqual(self.select(self.tests), [])
+
+    def test_changes_to_files_only_executed_on_import_select_all_tests(self):
+        self.write_file("src/c.py", "c = 1\n")
+        coverage_data = FakeCoverageData({"src/c.py": {1: [""]}})
+        self.impact_map.update([], coverage_data)
+        self.assertEqual(self.impact_map.imported, ["src/a.py", "src/b.py", "src/c.py"])
+        self.assertEqual(self.select(self.tests), [])
+        self.touch("src/c.py")
+        self.assertEqual(self.select(self.tests), ["test_a", "test_b"])
+
+    def test_changes_to_data_files_select_all_tests(self):
+        self.assertEqual(self.select(self.tests), [])
+        self.write_file("tests/data.json", "{}")
+        self.assertEqual(self.select(self.tests), ["test_a", "test_b"])
+        self.impact_map.update([], FakeCoverageData({}))
+        self.assertEqual(self.select(self.tests), [])
+        self.touch("tests/data.json")
+        self.assertEqual(self.select(self.tests), ["test_a", "test_b"])
+
+    def test_prune(self):
+        self.impact_map.prune({"test_a"})
+        self.assertEqual(self.impact_map.tests, {"test_a": ["src/a.py"]})
+
+    def test_load(self):
+        self.impact_map.save()
+        impact_map = impact.ImpactMap.load()
+        self.assertEqual(impact_map.tests, self.impact_map.tests)
+        self.assertEqual(impact_map.files, self.impact_map.files)
+
+    def test_map_is_stale_when_project_files_change(self):
+        self.impact_map.save()
+        self.touch("pyproject.toml")
+        self.assertIsNone(impact.ImpactMap.load())
+
+    def test_map_is_stale_when_version_changes(self):
+        self.impact_map.save()
+        with impact.ImpactMap.path.open() as fp:
+            data = json.load(fp)
+        data["version"] = 0
+        with impact.ImpactMap.path.open("w") as fp:
+            json.dump(data, fp)
+        self.assertIsNone(impact.ImpactMap.load())
+
+    def test_missing_map(self):
+        self.assertIsNone(impact.ImpactMap.load())
+
+
+class BenchmarkRunnerTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_file("src/pkg/__init__.py", '__version__ = "1.0"\n')
+        for name, template in (
+            ("benchmarks/benchmarks.py", make_package.BENCHMARKS_TEMPLATE),
+            ("benchmarks/run.py", make_package.BENCHMARK_RUNNER_TEMPLATE),
+        ):
+            self.write_file(name, string.Template(template).substitute(name="pkg"))
+
+    def run_benchmarks(self, *args):
+        return subprocess.run(
+            (sys.executable, "benchmarks/run.py", "-r", "2", "-w", "0", "-t", "0.001")
+            + args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+
+    def test_results(self):
+        result = self.run_benchmarks("--output", "results.json")
+        self.assertEqual(result.returncode, 0, result.stdout)
+        with (self.dir / "results.json").open() as fp:
+            results = json.load(fp)
+        self.assertEqual(results["commit"], "unknown")
+        self.assertEqual(list(results["benchmarks"]), ["benchmarks.bench_version"])
+        stats = results["benchmarks"]["benchmarks.bench_version"]
+        self.assertEqual(stats["repetitions"], 2)
+        self.assertEqual(len(stats["samples"]), 2)
+        self.assertLessEqual(stats["min"], stats["mean"])
+        self.assertLessEqual(stats["mean"], stats["max"])
+
+    def test_changes_to_package_mark_results_dirty(self):
+        def git(*args):
+            subprocess.run(("git", *args), check=True, stdout=subprocess.DEVNULL)
+
+        git("init", "--quiet")
+        git("add", ".")
+        git(
+            "-c",
+            "user.name=Test",
+            "-c",
+            "user.email=test@example.com",
+            "commit",
+            "-qm",
+            "Initial",
+        )
+        self.run_benchmarks("--output", "results.json")
+        with (self.dir / "results.json").open() as fp:
+            self.assertFalse(json.load(fp)["commit"].endswith("-dirty"))
+        self.write_file("src/pkg/__init__.py", '__version__ = "1.1"\n')
+        self.run_benchmarks("--output", "results.json")
+        with (self.dir / "results.json").open() as fp:
+            self.assertTrue(json.load(fp)["commit"].endswith("-dirty"))
+
+    def test_filter(self):
+        result = self.run_benchmarks("--filter", "nothing")
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("No benchmarks found", result.stdout)
+
+
+class DurationHistoryTests(TempDirTestCase):
+    def test_add_run_trims_history(self):
+        history = durations.DurationHistory()
+        history.max_samples = 3
+        history.max_runs = 2
+        for i in range(5):
+            history.add_run({"test_a": float(i)}, 10.0 + i)
+        self.assertEqual(history.tests, {"test_a": [2.0, 3.0, 4.0]})
+        self.assertEqual([run["duration"] for run in history.runs], [13.0, 14.0])
+        self.assertEqual(history.get_median("test_a"), 3.0)
+        self.assertIsNone(history.get_median("test_b"))
+
+    def test_save_and_load(self):
+        history = durations.DurationHistory()
+        history.add_run({"test_a": 1.0}, 1.0)
+        history.save()
+        loaded = durations.DurationHistory.load()
+        self.assertEqual(loaded.tests, history.tests)
+        self.assertEqual(loaded.runs, history.runs)
+
+    def test_print_slowest(self):
+        history = durations.DurationHistory({"test_a": [1.0, 2.0, 3.0]})
+        stream = io.StringIO()
+        test_durations = {"test_a": 3.0, "test_b": 0.5, "test_c": 1.0}
+        durations.print_slowest(stream, test_durations, history, 2)
+        self.assertEqual(
+            stream.getvalue().splitlines(),
+            [
+                "",
+                "Slowest 2 tests:",
+                "   3.000s test_a (+50% vs. median 2.000s)",
+                "   1.000s test_c",
+            ],
+        )
+        stream = io.StringIO()
+        durations.print_slowest(stream, {}, history, 2)
+        self.assertEqual(stream.getvalue(), "")
+
+
+class FailedTestsTests(TempDirTestCase):
+    def test_update(self):
+        failed_tests = failed.FailedTests({"test_a", "test_b"})
+        # test_b wasn't run, so it keeps its status
+        failed_tests.update({"test_a", "test_c"}, ["test_c"])
+        self.assertEqual(failed_tests.ids, {"test_b", "test_c"})
+        failed_tests.save()
+        self.assertEqual(failed.FailedTests.load().ids, {"test_b", "test_c"})
+
+    def test_sort_keeps_classes_together(self):
+        tests = [
+            (None, test)
+            for test in unittest.defaultTestLoader.loadTestsFromTestCase(Samples.A)
+        ] + [
+            (None, test)
+            for test in unittest.defaultTestLoader.loadTestsFromTestCase(Samples.B)
+        ]
+        failed_tests = failed.FailedTests(
+            {Samples.A("test_2").id(), Samples.B("test_2").id()}
+        )
+        names = [
+            f"{type(test).__qualname__}.{test._testMethodName}"
+            for _, test in failed_tests.sort(tests)
+        ]
+        self.assertEqual(
+            names,
+            [
+                "Samples.A.test_2",
+                "Samples.A.test_1",
+                "Samples.A.test_3",
+                "Samples.B.test_2",
+                "Samples.B.test_1",
+            ],
+        )
+
+
+class GetTestUnitTests(unittest.TestCase):
+    def test_test_case_method(self):
+        test = Samples.A("test_1")
+        self.assertEqual(
+            run_tests.get_test_unit(__name__, test), (__name__, "Samples.A")
+        )
+
+    def test_other_test(self):
+        # E.g., doctests added via load_tests
+        test = unittest.FunctionTestCase(lambda: None)
+        self.assertEqual(run_tests.get_test_unit(__name__, test), (__name__, None))
+
+
+class RunAllTestsTests(TempDirTestCase):
+    def test_discover_packages(self):
+        self.write_file("a/pyproject.toml", "")
+        self.write_file("a/tests/tests.py", "")
+        self.write_file("b/pyproject.toml", "")
+        self.write_file("c/tests/tests.py", "")
+        self.write_file("d/pyproject.toml", "")
+        self.write_file("d/tests/tests.py", "")
+        packages = run_all_tests.discover_packages(self.dir)
+        self.assertEqual([path.name for path in packages], ["a", "d"])
+
+    def test_coverage_total_re(self):
+        regex = run_all_tests.COVERAGE_TOTAL_RE
+        match = regex.search("TOTAL                          1033    368    64%")
+        self.assertEqual(match.group("percent"), "64%")
+        match = regex.search("TOTAL   10   2   4   1   78.57%  ")
+        self.assertEqual(match.group("percent"), "78.57%")
+        self.assertIsNone(regex.search("test_total ... ok 64%"))
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "Requires os.fork")
+class WatchTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_file("src/pkg/__init__.py", "")
+        self.write_file("tests/test_a.py", "")
+        self.log = self.dir / "runs.log"
+
+    def record_run(self):
+        with self.log.open("a") as fp:
+            fp.write("run\n")
+
+    def test_get_changed_paths(self):
+        dirs = [str(self.dir / "src"), str(self.dir / "tests")]
+        old = watch.get_snapshot(dirs)
+        self.assertEqual(
+            sorted(os.path.relpath(path) for path in old),
+            [
+                os.path.join("src", "pkg", "__init__.py"),
+                os.path.join("tests", "test_a.py"),
+            ],
+        )
+        self.write_file("tests/test_a.py", "# Changed\n")
+        self.write_file("tests/test_b.py", "")
+        new = watch.get_snapshot(dirs)
+        self.assertEqual(
+            watch.get_changed_paths(old, new),
+            [os.path.join("tests", "test_a.py"), os.path.join("tests", "test_b.py")],
+        )
+
+    def test_run_in_child_reports_modules_outside_dirs(self):
+        modules = watch.run_in_child(self.record_run, report_modules_outside=[SRC_DIR])
+        self.assertIn("json", modules)
+        self.assertNotIn("com.wyattbaldwin.watch", modules)
+        self.assertEqual(self.log.read_text(), "run\n")
+
+    def test_run_on_change(self):
+        sleeps = []
+
+        def sleep(interval):
+            sleeps.append(interval)
+            if len(sleeps) == 1:
+                self.write_file("src/pkg/__init__.py", "# Changed\n")
+            elif len(sleeps) == 3:
+                raise KeyboardInterrupt
+
+        with unittest.mock.patch.object(watch.time, "sleep", sleep):
+            code = watch.run_on_change(self.record_run, [], interval=0.01)
+        self.assertEqual(code, 0)
+        # Once at startup and once for the change
+        self.assertEqual(self.log.read_text(), "run\nrun\n")
+
+
+class RunTestsEndToEndTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_file("pyproject.toml", "")
+        self.write_file("src/pkg/__init__.py", "")
+        self.write_file("tests/__init__.py", "")
+        self.write_file("tests/test_a.py", SAMPLE_TEST_MODULE)
+        self.write_file("tests/test_b.py", SAMPLE_TEST_MODULE)
+
+    def run_tests(self, *args, fail=False):
+        env = os.environ.copy()
+        env["PYTHONPATH"] = os.pathsep.join((str(SRC_DIR), str(self.dir / "src")))
+        env.pop("FAIL", None)
+        if fail:
+            env["FAIL"] = "1"
+        return subprocess.run(
+            (sys.executable, "-m", "com.wyattbaldwin.run_tests", "-s", "0", *args),
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+
+    def test_jobs(self):
+        result = self.run_tests("--jobs", "2")
+        self.assertIn("Ran 6 tests", result.stdout)
+        self.assertIn("test_a.A ... ok (3 tests)", result.stdout)
+        self.assertIn("test_b.A ... ok (3 tests)", result.stdout)
+        self.assertIn("TOTAL", result.stdout)
+        result = self.run_tests("--jobs", "2", fail=True)
+        self.assertIn("test_b.A ... FAIL (3 tests)", result.stdout)
+        self.assertIn("Ran 6 tests", result.stdout)
+
+    def test_incremental_with_changes_to_module_level_code(self):
+        self.write_file("src/pkg/const.py", "X = 1\n")
+        self.write_file(
+            "tests/test_const.py",
+            "import unittest\n"
+            "from pkg.const import X\n"
+            "class Const(unittest.TestCase):\n"
+            "    def test_x(self):\n"
+            "        self.assertEqual(X, 1)\n",
+        )
+        for jobs in ("1", "2"):
+            with self.subTest(jobs=jobs):
+                self.write_file("src/pkg/const.py", "X = 1\n")
+                result = self.run_tests("-j", jobs)
+                self.assertEqual(result.returncode, 0, result.stdout)
+                result = self.run_tests("-i", "-j", jobs)
+                self.assertIn("No tests affected by changes", result.stdout)
+                self.write_file("src/pkg/const.py", "X = 2\n")
+                result = self.run_tests("-i", "-j", jobs)
+                self.assertEqual(result.returncode, 1, result.stdout)
+                self.assertIn("Ran 7 tests", result.stdout)
+
+    def test_incremental_runs_failed_tests(self):
+        for jobs in ("1", "2"):
+            with self.subTest(jobs=jobs):
+                result = self.run_tests("-j", jobs)
+                self.assertEqual(result.returncode, 0, result.stdout)
+                result = self.run_tests("-i", "-j", jobs, fail=True)
+                self.assertIn("No tests affected by changes", result.stdout)
+                result = self.run_tests("-j", jobs, fail=True)
+                self.assertEqual(result.returncode, 1, result.stdout)
+                result = self.run_tests("-i", "-j", jobs, fail=True)
+                self.assertEqual(result.returncode, 1, result.stdout)
+                self.assertIn("Running 1 of 6 tests", result.stdout)
+                self.assertIn("Ran 1 test", result.stdout)
+
+    def get_trace(self, output):
+        """Get the setUpClass calls and test IDs printed by the tests."""
+        return [
+            line.lstrip(".")
+            for line in output.splitlines()
+            if line.lstrip(".").startswith(("setUpClass", "test_"))
+        ]
+
+    def test_failed_tests_run_first(self):
+        result = self.run_tests("-C", fail=True)
+        self.assertEqual(result.returncode, 1, result.stdout)
+        result = self.run_tests("-C")
+        self.assertEqual(result.returncode, 0, result.stdout)
+        # Classes with failed tests come first, with their failed tests
+        # first, and their fixtures are only set up once
+        self.assertEqual(
+            self.get_trace(result.stdout),
+            [
+                "setUpClass",
+                "test_b.A.test_2",
+                "test_b.A.test_1",
+                "test_b.A.test_3",
+                "setUpClass",
+                "test_a.A.test_1",
+                "test_a.A.test_2",
+                "test_a.A.test_3",
+            ],
+        )
+
+    def test_fail_fast(self):
+        result = self.run_tests("--fail-fast", fail=True)
+        self.assertEqual(result.returncode, 1, result.stdout)
+        self.assertEqual(self.get_trace(result.stdout)[-1], "test_b.A.test_2")
+        self.assertIn("Ran 5 tests", result.stdout)
+        self.assertIn("Skipping coverage report due to failure", result.stdout)
+        self.assertNotIn("TOTAL", result.stdout)
+        # Failed tests are run first, so the next run stops right away
+        result = self.run_tests("--fail-fast", fail=True)
+        self.assertEqual(
+            self.get_trace(result.stdout), ["setUpClass", "test_b.A.test_2"]
+        )
+        self.assertIn("Ran 1 test", result.stdout)
+
+
+class Samples:
+    """Sample test cases; nested so they aren't discovered."""
+
+    class A(unittest.TestCase):
+        def test_1(self):
+            pass
+
+        def test_2(self):
+            pass
+
+        def test_3(self):
+            pass
+
+    class B(unittest.TestCase):
+        def test_1(self):
+            pass
+
+        def test_2(self):
+            pass
+
+
+# Only test_b.A.test_2 fails when $FAIL is set
+SAMPLE_TEST_MODULE = """\
+import os
+import unittest
+
+
+class A(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        print("setUpClass", flush=True)
+
+    def setUp(self):
+        print(self.id(), flush=True)
+
+    def test_1(self):
+        pass
+
+    def test_2(self):
+        self.assertFalse(os.getenv("FAIL") and __name__.endswith("test_b"))
+
+    def test_3(self):
+        pass
+"""
@@ -1,3 +1,11 @@
-from .release import make_release
-
 __version__ = "1.0a5.dev0"
+
+
+def __getattr__(name):
+    # Import the command on first access so that importing the package
+    # (e.g., to get its version) doesn't import the steps or runcommands.
+    if name == "make_release":
+        from .release import make_release
+
+        return make_release
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,4 +1,6 @@
-from .release import make_release
+import sys
+
+from .cli import main
 
 if __name__ == "__main__":
-    make_release.console_script()
+    sys.exit(main())
@@ -0,0 +1,233 @@
+import json
+import pathlib
+import shlex
+import statistics
+import tempfile
+from collections import namedtuple
+
+from runcommands.util import abort, printer
+
+from .timing import local
+from .util import get_latest_tag, print_step_header
+
+# Benchmark results for each release are stored as a note on the tagged
+# commit in this ref, so they're shared along with the tags.
+NOTES_REF = "refs/notes/make-release-benchmarks"
+
+DEFAULT_BENCHMARK_COMMAND = "python benchmarks/run.py --output {output}"
+
+
+Comparison = namedtuple(
+    "Comparison",
+    ("name", "baseline_time", "current_time", "change", "regression"),
+)
+
+
+def run_benchmarks(
+    info, benchmark_command=None, tolerance=0.1, tag_prefix=None, runs=3, remote=None
+):
+    """Run benchmarks and compare to results from the previous release.
+
+    The benchmark command must write results to the file specified by
+    ``{output}`` in the format written by the ``benchmarks/run.py``
+    harness generated by ``make-package``. When no command is specified
+    and there's no ``benchmarks/run.py``, benchmarking is skipped.
+
+    The benchmark command is run ``runs`` times, each in a separate
+    process, and the fastest time of each benchmark in each run is
+    recorded. Noise within a single process (e.g., CPU frequency or a
+    busy machine) therefore has to show up in every run to matter.
+
+    The baseline is the result recorded for the latest tag starting
+    with ``tag_prefix``. If ``remote`` is specified, results recorded
+    there are fetched and merged first. A benchmark has regressed when
+    its time in *every* run is more than ``tolerance`` (as a fraction)
+    slower than the median time in the baseline runs. The release is
+    aborted if any benchmark has regressed.
+
+    Returns the results so they can be recorded as the baseline for
+    this release once it's tagged, or ``None`` if benchmarking was
+    skipped.
+
+    """
+    print_step_header("Benchmarking")
+
+    if benchmark_command is None:
+        if not pathlib.Path("benchmarks/run.py").is_file():
+            printer.warning("Skipping benchmarks; benchmarks/run.py not found")
+            return None
+        benchmark_command = DEFAULT_BENCHMARK_COMMAND
+
+    run_results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for i in range(runs):
+            printer.info(f"Benchmark run {i + 1} of {runs}")
+            output = pathlib.Path(temp_dir) / f"results-{i}.json"
+            local(benchmark_command.format(output=shlex.quote(str(output))), echo=True)
+            with output.open() as fp:
+                run_results.append(json.load(fp))
+    results = combine_runs(run_results)
+
+    # Fetch even when there's no previous release, since other packages
+    # may have recorded results in the same notes ref.
+    if remote:
+        fetch_baselines(remote)
+
+    previous_tag = get_latest_tag(tag_prefix)
+    if previous_tag is None:
+        printer.warning("No previous release to compare benchmarks to")
+        return results
+
+    baseline = read_baseline(previous_tag)
+    if baseline is None:
+        printer.warning("No benchmark results recorded for", previous_tag)
+        return results
+
+    comparisons = compare_results(baseline, results, tolerance)
+    printer.print()
+    printer.info("Compared to", previous_tag)
+    for comparison in comparisons:
+        line = (
+            f"{comparison.name}: {comparison.current_time:.3g}s vs. "
+            f"{comparison.baseline_time:.3g}s ({comparison.change:+.1%})"
+        )
+        if comparison.regression:
+            printer.error(line)
+        else:
+            printer.print(line)
+
+    regressions = [c.name for c in comparisons if c.regression]
+    if regressions:
+        abort(
+            13,
+            f"Benchmarks regressed by more than {tolerance:.0%} in all {runs} "
+            f"runs since {previous_tag}: {', '.join(regressions)}",
+        )
+
+    return results
+
+
+def combine_runs(run_results):
+    """Combine results of separate runs of the benchmark command.
+
+    The fastest time of each benchmark in each run is kept.
+
+    >>> combine_runs([
+    ...     {"benchmarks": {"a": {"min": 1.0}, "b": {"min": 2.0}}},
+    ...     {"benchmarks": {"a": {"min": 1.5}}},
+    ... ])
+    {'benchmarks': {'a': {'runs': [1.0, 1.5]}, 'b': {'runs': [2.0]}}}
+
+    """
+    benchmarks = {}
+    for results in run_results:
+        for name, stats in results["benchmarks"].items():
+            benchmarks.setdefault(name, {"runs": []})["runs"].append(stats["min"])
+    return {"benchmarks": benchmarks}
+
+
+def compare_results(baseline, current, tolerance=0.1):
+    """Compare benchmarks that are in both sets of results.
+
+    A benchmark has only regressed if it's slower than the baseline by
+    more than ``tolerance`` in every run.
+
+    >>> baseline = {"benchmarks": {
+    ...     "a": {"runs": [1.0, 1.1, 1.0]},
+    ...     "b": {"runs": [1.0, 1.0, 1.0]},
+    ...     "c": {"runs": [1.0, 1.0, 1.0]},
+    ... }}
+    >>> current = {"benchmarks": {
+    ...     "a": {"runs": [1.2, 1.3, 1.2]},
+    ...     "b": {"runs": [1.5, 1.0, 1.5]},
+    ...     "c": {"runs": [1.05, 1.05, 1.05]},
+    ...     "d": {"runs": [9.0, 9.0, 9.0]},
+    ... }}
+    >>> [(c.name, c.regression) for c in compare_results(baseline, current)]
+    [('a', True), ('b', False), ('c', False)]
+
+    """
+    comparisons = []
+    baseline = baseline["benchmarks"]
+    current = current["benchmarks"]
+    for name in sorted(baseline.keys() & current.keys()):
+        old = statistics.median(baseline[name]["runs"])
+        new = statistics.median(current[name]["runs"])
+        change = (new - old) / old
+        limit = old * (1 + tolerance)
+        regression = all(time > limit for time in current[name]["runs"])
+        comparisons.append(Comparison(name, old, new, change, regression))
+    return comparisons
+
+
+def fetch_baselines(remote):
+    """Fetch results recorded on ``remote`` and merge them into ours.
+
+    Notes aren't fetched by default, so without this, results recorded
+    in other clones wouldn't be found, and pushing our notes ref would
+    be rejected because it would be unrelated to the remote's.
+
+    """
+    remote_ref = f"refs/notes/remotes/{remote}/{NOTES_REF.rsplit('/', 1)[1]}"
+    result = local(
+        ("git", "fetch", "--quiet", remote, f"+{NOTES_REF}:{remote_ref}"),
+        stdout="capture",
+        stderr="capture",
+        raise_on_error=False,
+    )
+    if result.failed:
+        # The remote is unreachable or no results have been pushed yet
+        printer.warning("Could not fetch benchmark results from", remote)
+        return
+    # Results already on the remote win if both have results for the
+    # same commit.
+    local(
+        (
+            "git",
+            "notes",
+            "--ref",
+            NOTES_REF,
+            "merge",
+            "--quiet",
+            "-s",
+            "theirs",
+            remote_ref,
+        )
+    )
+
+
+def read_baseline(tag_name):
+    result = local(
+        ("git", "notes", "--ref", NOTES_REF, "show", f"{tag_name}^{{commit}}"),
+        stdout="capture",
+        stderr="capture",
+        raise_on_error=False,
+    )
+    if result.failed:
+        return None
+    try:
+        return json.loads(result.stdout)
+    except ValueError:
+        return None
+
+
+def record_baseline(info, results):
+    """Record benchmark results for the release tag's commit."""
+    printer.info("Recording benchmark results for", info.tag_name)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = pathlib.Path(temp_dir) / "results.json"
+        with path.open("w") as fp:
+            json.dump(results, fp, indent=2)
+        local(
+            (
+                "git",
+                "notes",
+                "--ref",
+                NOTES_REF,
+                "add",
+                "--force",
+                "--file",
+                str(path),
+                f"{info.tag_name}^{{commit}}",
+            )
+        )
@@ -0,0 +1,135 @@
+import hashlib
+import pathlib
+import shlex
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from runcommands.util import printer
+
+from .timing import confirm, local
+from .util import get_cache_dir, get_package_prefix, print_step_header
+
+DEFAULT_BUILD_COMMAND = "python -m build --{format} --outdir {outdir}"
+
+
+def build_distributions(info, build_command=None, repository=None):
+    """Build sdist and wheel from the release tag and optionally publish.
+
+    The distributions are built in parallel, each from its own temporary
+    worktree checked out at the release tag, so uncommitted changes
+    can't leak into them and the builds can't race on build artifacts
+    (e.g., ``build/`` and ``*.egg-info``). They're cached by the hash of
+    the package's tree at the tag and the build command, so retrying a
+    release (or re-releasing an identical tree) reuses the existing
+    distributions instead of rebuilding them.
+
+    """
+    print_step_header(f"Building {info.name} release", info.version)
+
+    build_command = build_command or DEFAULT_BUILD_COMMAND
+    prefix = get_package_prefix()
+    tree = get_package_tree(info.tag_name, prefix)
+    cache_dir = get_cache_dir() / "builds" / get_build_cache_key(tree, build_command)
+
+    if cache_dir.is_dir():
+        printer.warning("Using cached distributions for tree", tree[:12])
+    else:
+        build_from_tag(info.tag_name, prefix, build_command, cache_dir)
+
+    distributions = sorted(cache_dir.iterdir())
+    for path in distributions:
+        printer.info("Distribution:", path.name)
+
+    if repository:
+        publish_distributions(info, distributions, repository)
+
+    return distributions
+
+
+def get_package_tree(tag_name, prefix):
+    result = local(("git", "rev-parse", f"{tag_name}:{prefix}"), stdout="capture")
+    return result.stdout.strip()
+
+
+def get_build_cache_key(tree, build_command):
+    data = f"{tree}\0{build_command}".encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+def build_from_tag(tag_name, prefix, build_command, cache_dir):
+    formats = ("sdist", "wheel")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = pathlib.Path(temp_dir)
+        out_dir = temp_dir / "dist"
+        worktree_dirs = []
+        try:
+            for format in formats:
+                worktree_dir = temp_dir / f"worktree-{format}"
+                local(
+                    ("git", "worktree", "add", "--detach", str(worktree_dir), tag_name)
+                )
+                worktree_dirs.append(worktree_dir)
+            with ThreadPoolExecutor(max_workers=len(formats)) as executor:
+                futures = [
+                    executor.submit(
+                        run_build, build_command, format, worktree_dir / prefix, out_dir
+                    )
+                    for format, worktree_dir in zip(formats, worktree_dirs)
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            for worktree_dir in worktree_dirs:
+                local(("git", "worktree", "remove", "--force", str(worktree_dir)))
+        # Move into place only after both builds succeed so that the
+        # cache never contains partial results.
+        cache_dir.parent.mkdir(exist_ok=True)
+        shutil.move(str(out_dir), str(cache_dir))
+
+
+def run_build(build_command, format, package_dir, out_dir):
+    command = build_command.format(
+        format=format,
+        outdir=shlex.quote(str(out_dir)),
+    )
+    printer.echo(command)
+    result = local(
+        command,
+        cd=str(package_dir),
+        stdout="capture",
+        stderr="capture",
+        raise_on_error=False,
+    )
+    if result.failed:
+        printer.error(f"{result.stdout or ''}{result.stderr or ''}".rstrip())
+        raise result
+    return result
+
+
+def publish_distributions(info, distributions, repository):
+    """Publish distributions to a package index in a single batch.
+
+    If ``repository`` is a URL, the distributions are uploaded with
+    ``twine``. Otherwise, it's treated as a local directory (e.g., one
+    served as a simple index), and the distributions are copied into it.
+
+    """
+    if info.confirmation_required:
+        msg = f"Publish {len(distributions)} distributions to {repository}?"
+        confirm(msg, abort_on_unconfirmed=True)
+    else:
+        printer.warning("Publishing distributions to", repository)
+
+    if repository.startswith("file://"):
+        repository = repository[len("file://") :]
+    elif "://" in repository:
+        files = [str(path) for path in distributions]
+        local(("twine", "upload", "--repository-url", repository, files), echo=True)
+        return
+
+    directory = pathlib.Path(repository)
+    directory.mkdir(parents=True, exist_ok=True)
+    for path in distributions:
+        shutil.copy2(path, directory / path.name)
+        printer.info("Copied", path.name, "to", directory)
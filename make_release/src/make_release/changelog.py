@@ -0,0 +1,155 @@
+import re
+from collections import namedtuple
+
+from runcommands.util import abort, printer
+
+from .util import read_cache_file, write_cache_file
+
+# E.g.: ## 1.0.0 - unreleased
+HEADER_RE = re.compile(rb"^## (?P<version>.+) - (?P<date>.+?)\r?\n?$")
+
+DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+ChangeLogSection = namedtuple(
+    "ChangeLogSection",
+    (
+        "version",
+        "date",
+        "line_number",
+        # Byte offsets of the header line and the end of the section
+        "start",
+        "end",
+    ),
+)
+
+
+class ChangeLog:
+    """Index of the release sections in a change log.
+
+    The version, date, line number, and byte offsets of each section are
+    recorded on the first scan and cached. The cached index is reused as
+    long as the change log's mtime and size are unchanged, and sections
+    are read by seeking directly to them, so looking up a section
+    doesn't require scanning the file.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sections = self._load_index()
+
+    def _load_index(self):
+        key = str(self.path.resolve())
+        stat = self.path.stat()
+        stat = [stat.st_mtime_ns, stat.st_size]
+        index = read_cache_file("change-log-index.json")
+        entry = index.get(key)
+        if entry is not None and entry["stat"] == stat:
+            return [ChangeLogSection(*section) for section in entry["sections"]]
+        sections = self._scan()
+        index[key] = {"stat": stat, "sections": sections}
+        write_cache_file("change-log-index.json", index)
+        return sections
+
+    def _scan(self):
+        sections = []
+        offset = 0
+        with self.path.open("rb") as fp:
+            for line_number, line in enumerate(fp):
+                # Skip the regex for lines that obviously aren't headers
+                if line.startswith(b"## "):
+                    match = HEADER_RE.search(line)
+                    if match:
+                        if sections:
+                            sections[-1] = sections[-1]._replace(end=offset)
+                        version = match.group("version").decode("utf-8")
+                        date = match.group("date").decode("utf-8")
+                        sections.append(
+                            ChangeLogSection(version, date, line_number, offset, None)
+                        )
+                offset += len(line)
+        if sections:
+            sections[-1] = sections[-1]._replace(end=offset)
+        return sections
+
+    def get_section(self, version):
+        for section in self.sections:
+            if section.version == version:
+                return section
+        return None
+
+    def get_notes(self, version):
+        """Get the notes for the specified version.
+
+        This is the content of the version's section, without the
+        header. Returns ``None`` if there's no section for the version.
+
+        """
+        section = self.get_section(version)
+        if section is None:
+            return None
+        with self.path.open("rb") as fp:
+            fp.seek(section.start)
+            content = fp.read(section.end - section.start)
+        content = content.decode("utf-8")
+        _, _, notes = content.partition("\n")
+        return notes.strip()
+
+    def validate(self):
+        """Check the order of the section headers.
+
+        Returns a list of problems, which will be empty if the headers
+        are all in order:
+
+        - Only the first section may be unreleased
+        - Versions must not be repeated
+        - Release dates must be in descending order
+
+        """
+        problems = []
+        seen = set()
+        previous = None
+        for i, section in enumerate(self.sections):
+            where = f"{self.path.name}:{section.line_number + 1}"
+            if section.version in seen:
+                problems.append(f"{where}: Duplicate version: {section.version}")
+            seen.add(section.version)
+            if section.date == "unreleased":
+                if i:
+                    problems.append(
+                        f"{where}: Only the first section can be unreleased: "
+                        f"{section.version}"
+                    )
+                continue
+            if not DATE_RE.search(section.date):
+                continue
+            if previous is not None and section.date > previous.date:
+                problems.append(
+                    f"{where}: Release date {section.date} of {section.version} "
+                    f"is after {previous.date} of {previous.version}"
+                )
+            previous = section
+        return problems
+
+
+def find_change_log_section(change_log, version):
+    # Find the first section header. The version must be the specified
+    # release version OR the date must be the literal string
+    # 'unreleased'.
+    sections = ChangeLog(change_log).sections
+    if not sections:
+        abort(8, "Could not find section in change log")
+    section = sections[0]
+    if section.version == version:
+        if section.date != "unreleased":
+            printer.warning("Re-releasing", version)
+    elif section.date == "unreleased":
+        printer.warning("Replacing", section.version, "with", version)
+    else:
+        msg = (
+            f"Expected version {version} or release date "
+            f'"unreleased"; got:\n\n    ## {section.version} - {section.date}'
+        )
+        abort(7, msg)
+    return section.line_number
@@ -0,0 +1,22 @@
+import sys
+
+
+def main(argv=None):
+    """Run the ``make-release`` console script.
+
+    Showing the version only requires the package's ``__init__`` module,
+    so that's handled here without importing the command, its steps, or
+    runcommands, which keeps ``make-release --show-version`` fast.
+
+    """
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv in (["-s"], ["--show-version"]):
+        from . import __version__
+
+        print(f"make-release version {__version__}")
+        return 0
+
+    from .release import make_release
+
+    return make_release.console_script(argv)
@@ -1,6 +1,6 @@
-from runcommands.commands import local
-from runcommands.util import confirm, printer, prompt
+from runcommands.util import printer
 
+from .timing import confirm, local, prompt
 from .util import get_current_branch, print_step_header
 
 
@@ -40,7 +40,7 @@ def merge_to_target_branch(info):
             "into",
             info.target_branch,
             "for release",
-            info.release,
+            info.version,
         )
 
     local(("git", "checkout", info.target_branch))
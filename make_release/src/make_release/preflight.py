@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from .changelog import ChangeLog
+from .timing import local
+from .util import ref_exists
+
+
+def run_preflight_checks(info, merge, tag, prepare=True, build=False):
+    """Run read-only checks concurrently before the release begins.
+
+    This catches problems that would otherwise only be found partway
+    through the release (e.g., a tag that already exists). Returns a
+    list of all the problems found by all the checks.
+
+    """
+    checks = [
+        (check_working_tree,),
+        (check_branch_exists, info.source_branch),
+        (check_change_log, info.change_log),
+    ]
+    if merge:
+        checks.append((check_branch_exists, info.target_branch))
+        # The prepare step always creates a commit to merge
+        if not prepare:
+            checks.append(
+                (check_changes_to_merge, info.source_branch, info.target_branch)
+            )
+    if tag:
+        checks.append((check_tag_available, info.tag_name))
+    elif build:
+        # Distributions are built from the tag, so it has to exist already
+        checks.append((check_tag_exists, info.tag_name))
+    with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+        futures = [executor.submit(*check) for check in checks]
+        return [problem for future in futures for problem in future.result()]
+
+
+def git(*args):
+    return local(
+        ("git", *args),
+        stdout="capture",
+        stderr="capture",
+        raise_on_error=False,
+    )
+
+
+def check_working_tree():
+    result = git("status", "--porcelain", "--untracked-files=no")
+    if result.stdout.strip():
+        files = "\n    ".join(result.stdout_lines)
+        return [f"Working tree has uncommitted changes:\n    {files}"]
+    return []
+
+
+def check_branch_exists(branch):
+    if ref_exists(f"refs/heads/{branch}"):
+        return []
+    return [f"Branch does not exist: {branch}"]
+
+
+def check_tag_available(tag_name):
+    if ref_exists(f"refs/tags/{tag_name}"):
+        return [f"Tag already exists: {tag_name}"]
+    return []
+
+
+def check_tag_exists(tag_name):
+    if ref_exists(f"refs/tags/{tag_name}"):
+        return []
+    return [f"Tag does not exist (needed to build without tagging): {tag_name}"]
+
+
+def check_changes_to_merge(source_branch, target_branch):
+    result = git("log", "--oneline", f"{target_branch}..{source_branch}")
+    if result.succeeded and not result.stdout.strip():
+        return [f"No changes to merge from {source_branch} into {target_branch}"]
+    return []
+
+
+def check_change_log(change_log):
+    return ChangeLog(change_log).validate()
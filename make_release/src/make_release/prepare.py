@@ -1,7 +1,7 @@
-from runcommands.commands import local
-from runcommands.util import confirm, printer, prompt
+from runcommands.util import printer
 
-from .util import get_current_branch, print_step_header, update_line
+from .timing import confirm, local, prompt
+from .util import FileEdits, get_current_branch, print_step_header
 
 
 def prepare_release(info):
@@ -12,9 +12,11 @@ def prepare_release(info):
 
     local(("git", "checkout", info.source_branch))
 
+    edits = FileEdits()
+
     if info.pyproject_file:
         quote = info.pyproject_version_quote
-        update_line(
+        edits.replace_line(
             info.pyproject_file,
             info.pyproject_version_line_number,
             f"version = {quote}{version}{quote}",
@@ -22,18 +24,20 @@ def prepare_release(info):
 
     if info.version_file:
         quote = info.version_quote
-        update_line(
+        edits.replace_line(
             info.version_file,
             info.version_line_number,
             f"__version__ = {quote}{version}{quote}",
         )
 
-    update_line(
+    edits.replace_line(
         info.change_log,
         info.change_log_line_number,
         f"## {version} - {info.date}",
     )
 
+    edits.apply()
+
     commit_files = (info.pyproject_file, info.version_file, info.change_log)
     local(("git", "diff", *commit_files))
 
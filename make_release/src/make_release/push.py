@@ -0,0 +1,31 @@
+from runcommands.util import printer
+
+from .timing import confirm, local
+from .util import print_step_header
+
+
+def push_release_refs(info, refs, remote="origin"):
+    """Push refs created during the release in a single atomic push.
+
+    ``refs`` should be fully qualified (e.g., ``refs/heads/dev`` or
+    ``refs/tags/1.0``). With ``--atomic``, either all the refs are
+    updated on the remote or none of them are.
+
+    """
+    print_step_header(f"Pushing {info.name} release", info.version, "to", remote)
+
+    if not refs:
+        printer.warning("No refs to push")
+        return
+
+    for ref in refs:
+        printer.info("Ref:", ref)
+
+    printer.print()
+    if info.confirmation_required:
+        confirm(f"Push these refs to {remote}?", abort_on_unconfirmed=True)
+    else:
+        printer.warning("Pushing refs to", remote)
+
+    refspecs = [f"{ref}:{ref}" for ref in refs]
+    local(("git", "push", "--atomic", remote, refspecs), echo=True)
@@ -0,0 +1,139 @@
+import functools
+import os
+import pathlib
+
+
+class GitRefs:
+    """Read refs directly from a git directory.
+
+    This answers simple questions like "what's the current branch?" and
+    "does this tag exist?" without spawning a ``git`` process. Only the
+    standard files-based ref layout is supported: ``HEAD``, loose refs
+    under ``refs/``, and ``packed-refs``. In a linked worktree, ``HEAD``
+    is read from the worktree's git directory and everything else from
+    the common git directory.
+
+    Use :func:`get_git_refs` to get an instance; it returns ``None``
+    when the layout isn't supported, in which case callers should fall
+    back to the ``git`` CLI.
+
+    """
+
+    def __init__(self, git_dir, common_dir=None):
+        self.git_dir = pathlib.Path(git_dir)
+        self.common_dir = pathlib.Path(common_dir or git_dir)
+        self._packed_refs = None
+        self._packed_refs_stat = None
+
+    @classmethod
+    def find(cls, path):
+        """Find git directory for ``path``; returns ``None`` if unusual."""
+        if os.environ.get("GIT_DIR") or os.environ.get("GIT_COMMON_DIR"):
+            return None
+        path = pathlib.Path(path).resolve()
+        for directory in (path, *path.parents):
+            dot_git = directory / ".git"
+            if dot_git.is_dir():
+                git_dir = dot_git
+                break
+            if dot_git.is_file():
+                # Linked worktree or submodule: "gitdir: <path>"
+                content = dot_git.read_text().strip()
+                if not content.startswith("gitdir: "):
+                    return None
+                git_dir = directory / content[len("gitdir: ") :]
+                break
+        else:
+            return None
+
+        common_dir = git_dir
+        common_dir_file = git_dir / "commondir"
+        if common_dir_file.is_file():
+            common_dir = git_dir / common_dir_file.read_text().strip()
+
+        # The reftable backend stores refs in a binary format
+        config_file = common_dir / "config"
+        if config_file.is_file():
+            if "refstorage" in config_file.read_text().lower():
+                return None
+
+        if not (git_dir / "HEAD").is_file():
+            return None
+
+        return cls(git_dir.resolve(), common_dir.resolve())
+
+    def read_head(self):
+        """Read HEAD; returns a ref name or commit SHA."""
+        content = (self.git_dir / "HEAD").read_text().strip()
+        if content.startswith("ref: "):
+            return content[len("ref: ") :]
+        return content
+
+    def current_branch(self):
+        """Get the current branch like ``git rev-parse --abbrev-ref``.
+
+        Returns "HEAD" when HEAD is detached.
+
+        """
+        head = self.read_head()
+        if head.startswith("refs/heads/"):
+            return head[len("refs/heads/") :]
+        return "HEAD"
+
+    def resolve(self, ref):
+        """Get the SHA for the fully qualified ``ref``.
+
+        Symbolic refs are followed. Returns ``None`` if the ref doesn't
+        exist.
+
+        """
+        for _ in range(10):
+            path = self.common_dir / ref
+            if ref == "HEAD":
+                path = self.git_dir / ref
+            if path.is_file():
+                content = path.read_text().strip()
+                if content.startswith("ref: "):
+                    ref = content[len("ref: ") :]
+                    continue
+                return content
+            return self.get_packed_refs().get(ref)
+        return None
+
+    def exists(self, ref):
+        return self.resolve(ref) is not None
+
+    def get_packed_refs(self):
+        """Read ``packed-refs``, reusing the result until it changes."""
+        path = self.common_dir / "packed-refs"
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return {}
+        stat = (stat.st_mtime_ns, stat.st_size)
+        if stat != self._packed_refs_stat:
+            packed_refs = {}
+            with path.open() as fp:
+                for line in fp:
+                    # Skip header and peeled tag lines
+                    if line.startswith(("#", "^")):
+                        continue
+                    sha, _, ref = line.strip().partition(" ")
+                    packed_refs[ref] = sha
+            self._packed_refs = packed_refs
+            self._packed_refs_stat = stat
+        return self._packed_refs
+
+
+@functools.lru_cache()
+def _get_git_refs(cwd):
+    return GitRefs.find(cwd)
+
+
+def get_git_refs():
+    """Get :class:`GitRefs` for the CWD, cached for the run.
+
+    Returns ``None`` if the repo layout isn't supported.
+
+    """
+    return _get_git_refs(os.getcwd())
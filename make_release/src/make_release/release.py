@@ -1,36 +1,39 @@
-import datetime
 import pathlib
 
 from runcommands.args import arg
 from runcommands.command import command
-from runcommands.commands.local import local
-from runcommands.util import abort, confirm, printer
+from runcommands.util import abort, printer
 
-from .merge import merge_to_target_branch
-from .prepare import prepare_release
-from .resume import resume_development
-from .tag import create_release_tag
+from .changelog import ChangeLog, find_change_log_section
+from .timing import confirm, timer
 from .util import (
     ReleaseInfo,
     find_change_log,
-    find_change_log_section,
     find_version_file,
     get_current_branch,
     get_current_version,
     get_next_version,
     print_info,
     print_step,
-    print_step_header,
 )
 
 
 @command(read_config=True)
 def make_release(
     # Steps
+    preflight: arg(
+        short_option="-k",
+        help="Check for problems before starting the release",
+    ) = True,
     test: arg(
         short_option="-e",
         help="Run tests first",
     ) = True,
+    benchmark: arg(
+        short_option="-q",
+        help="Run benchmarks and abort if they're slower than last release",
+        inverse_help="Skip benchmarks",
+    ) = False,
     prepare: arg(
         short_option="-p",
         help="Run release preparation tasks",
@@ -43,14 +46,51 @@ def make_release(
         short_option="-t",
         help="Create release tag",
     ) = True,
+    build: arg(
+        short_option="-u",
+        help="Build distributions from release tag",
+    ) = False,
     resume: arg(
         short_option="-r",
         help="Run resume development tasks",
     ) = True,
+    push: arg(
+        short_option="-g",
+        help="Push release branches and tag to remote",
+    ) = False,
     test_command: arg(
         short_option="-c",
         help="Test command",
     ) = None,
+    test_jobs: arg(
+        short_option="-j",
+        type=int,
+        help=(
+            "Run tests in this many parallel shards when no test command "
+            "is specified; 0 means one per CPU [1]"
+        ),
+    ) = 1,
+    test_cache: arg(
+        short_option="-x",
+        help="Skip tests when the same tree already passed the test command",
+    ) = True,
+    benchmark_command: arg(
+        help=(
+            "Command that runs benchmarks and writes results to {output} "
+            '["python benchmarks/run.py --output {output}"]'
+        ),
+    ) = None,
+    benchmark_tolerance: arg(
+        type=float,
+        help="Allowed slowdown relative to last release as a fraction [0.1]",
+    ) = 0.1,
+    benchmark_runs: arg(
+        type=int,
+        help=(
+            "Run the benchmark command this many times; a slowdown must "
+            "show up in every run [3]"
+        ),
+    ) = 3,
     # Step config
     name: arg(
         short_option="-n",
@@ -62,7 +102,10 @@ def make_release(
     ) = None,
     version_file: arg(
         short_option="-V",
-        help="File __version__ is in [search typical files]",
+        help=(
+            "File __version__ is in; set this in the project config to skip "
+            "searching [search typical files]"
+        ),
     ) = None,
     date: arg(
         short_option="-d",
@@ -87,12 +130,44 @@ def make_release(
         short_option="-w",
         help="Anticipated version of next release",
     ) = None,
+    build_command: arg(
+        short_option="-l",
+        help=(
+            "Command used to build each distribution; {format} (sdist or "
+            "wheel) and {outdir} will be substituted "
+            '["python -m build --{format} --outdir {outdir}"]'
+        ),
+    ) = None,
+    repository: arg(
+        short_option="-o",
+        help=(
+            "Package index URL to upload distributions to with twine, or "
+            "local directory to copy them into [don't publish]"
+        ),
+    ) = None,
+    remote: arg(
+        short_option="-z",
+        help="Remote to push to [origin]",
+    ) = "origin",
     # Other
+    timings: arg(
+        short_option="-i",
+        help="Show how long each step, command, and prompt took",
+    ) = True,
+    trace_file: arg(
+        short_option="-f",
+        help="Write timings to file in Chrome trace format (for Perfetto)",
+    ) = None,
     yes: arg(
         short_option="-y",
         no_inverse=True,
         help="Run without being prompted for any confirmations",
     ) = False,
+    show_notes: arg(
+        short_option="-N",
+        long_option="--show-notes",
+        help="Show release notes for version from change log and exit",
+    ) = None,
     show_version: arg(
         short_option="-s",
         long_option="--show-version",
@@ -106,6 +181,28 @@ def make_release(
     the next version based on the release version.
 
     Steps:
+        - Preflight checks:
+            - Before asking whether to continue, check concurrently
+              that the working tree is clean, the branches exist, there
+              are changes to merge, the tag doesn't already exist (or,
+              when building without tagging, that it does exist), and
+              the change log's section headers are in order; all
+              problems are reported at once
+        - Run tests:
+            - Run the test command; passing runs are cached by the tree
+              hash of the source branch and the test command, and the
+              tests are skipped when the same tree has already passed
+            - When no test command is specified, the test modules can be
+              run in parallel shards instead (see ``--test-jobs``)
+        - Run benchmarks (only when ``--benchmark`` is passed and
+          there's a ``benchmarks/run.py`` or a benchmark command is
+          specified):
+            - Run the benchmark command ``--benchmark-runs`` times in
+              separate processes and compare the results to those
+              recorded for the previous release tag (fetched from the
+              remote first)
+            - Abort if any benchmark is slower than the previous release
+              by more than ``--benchmark-tolerance`` in every run
         - Prepare release:
             - Update ``version`` in ``pyproject.toml`` (if present)
             - Update ``__version__`` in version file (if present;
@@ -116,10 +213,23 @@ def make_release(
         - Merge to target branch (``prod`` by default):
             - Merge current branch into target branch with merge message
         - Create tag:
-            - Add annotated tag for latest version; when merging, the
+            - Add annotated tag for latest version with the release
+              notes from the change log; when merging, the
               tag will point at the merge commit on the target branch;
               when not merging, the tag will point at the prepare
               release commit on the current branch
+            - Record the benchmark results, if any, as a git note on
+              the tagged commit (in ``refs/notes/make-release-benchmarks``)
+              to be used as the baseline for the next release
+        - Build distributions (only when ``--build`` is passed):
+            - Build sdist and wheel in parallel, each from its own
+              temporary worktree checked out at the release tag;
+              distributions are cached by the package's tree hash at
+              the tag and the build command, so they're only built once
+              for a given tree
+            - Publish all distributions in one batch to the package
+              index specified via ``--repository`` (if specified); this
+              can be a URL (uploaded with ``twine``) or a directory
         - Resume development:
             - Update version in ``pyproject.toml`` to next version (if
               present)
@@ -128,6 +238,19 @@ def make_release(
             - Add in-progress section for next version to change log
             - Commit version file and change log with resume message
 
+        - Push (only when ``--push`` is passed):
+            - Push all the branches, tags, and benchmark notes created
+              by the previous steps to the remote (``origin`` by
+              default) in a single atomic push
+
+    Timings:
+        - When the release finishes (or is aborted), a summary of how
+          long each step took, along with time spent running commands
+          and waiting for input, is shown
+        - Use ``--trace-file`` to also write a trace of every step,
+          command, and prompt that can be loaded into Perfetto or
+          ``chrome://tracing``
+
     Caveats:
         - The next version will have the dev marker ".dev0" appended to
           it
@@ -137,10 +260,9 @@ def make_release(
         - The first release section header in the change log will be
           updated, so there always needs to be an in-progress section
           for the next version
-        - Building distributions and uploading to PyPI isn't handled;
-          after creating a release, build distributions using
-          ``python setup.py sdist`` or ``poetry build`` (for example)
-          and then upload them with ``twine upload``
+        - Distributions are only built when ``--build`` is passed; the
+          default build command requires the ``build`` package, and
+          uploading to a package index requires ``twine``
 
     """
     if show_version:
@@ -149,6 +271,15 @@ def make_release(
         print(f"make-release version {__version__}")
         return
 
+    if show_notes:
+        notes = ChangeLog(find_change_log()).get_notes(show_notes)
+        if notes is None:
+            abort(11, f"Version not found in change log: {show_notes}")
+        print(notes)
+        return
+
+    timer.reset()
+
     cwd = pathlib.Path.cwd()
     name = name or cwd.name
 
@@ -162,16 +293,24 @@ def make_release(
         print()
 
     printer.header("Releasing", name)
+    print_step("Preflight checks?", preflight)
     print_step("Testing?", test)
+    print_step("Benchmarking?", benchmark)
     print_step("Preparing?", prepare)
     print_step("Merging?", merge)
     print_step("Tagging?", tag)
+    print_step("Building?", build)
     print_step("Resuming development?", resume)
+    print_step("Pushing?", push)
 
     if merge:
         if source_branch == target_branch:
             abort(1, f"Dev branch and target branch are the same: {source_branch}")
 
+    # These lookups stay serial rather than running in the preflight
+    # pool: they read refs and files in-process (a few milliseconds in
+    # total), and the version they determine is needed to build the
+    # preflight checks (e.g., the tag name).
     pyproject_file = pathlib.Path("pyproject.toml")
     if pyproject_file.is_file():
         pyproject_version_info = get_current_version(pyproject_file, "version")
@@ -191,7 +330,7 @@ def make_release(
         version_info = get_current_version(version_file)
         version_line_number, version_quote, current_version = version_info
     else:
-        version_info = find_version_file()
+        version_info = find_version_file(name)
         if version_info is not None:
             (
                 version_file,
@@ -226,12 +365,20 @@ def make_release(
             )
             abort(3, message)
 
+    # Previous release tags start with the part of the tag name before
+    # the version (e.g., "{name}-" in a monorepo).
+    tag_prefix = None
     if tag_name:
+        if "{version}" in tag_name:
+            tag_prefix = tag_name.partition("{version}")[0].format(name=name) or None
         tag_name = tag_name.format(name=name, version=version)
     else:
         tag_name = version
 
-    date = date or datetime.date.today().isoformat()
+    if not date:
+        import datetime
+
+        date = datetime.date.today().isoformat()
 
     if not next_version:
         next_version = get_next_version(version)
@@ -258,6 +405,19 @@ def make_release(
         not yes,
     )
 
+    # Step modules are imported only when the corresponding step runs
+    # to keep startup fast.
+
+    if preflight:
+        from .preflight import run_preflight_checks
+
+        with timer.span("run_preflight_checks", "step"):
+            problems = run_preflight_checks(info, merge, tag, prepare, build)
+        if problems:
+            for problem in problems:
+                printer.error(problem)
+            abort(12, "Preflight checks failed; use --no-preflight to skip them")
+
     print_info("Version:", info.version)
     print_info("Release date:", info.date)
     if merge:
@@ -274,25 +434,80 @@ def make_release(
     else:
         printer.warning("Continuing with release: {info.version} - {info.date}")
 
-    if test:
-        print_step_header("Testing")
-        if test_command is None:
-            if (cwd / "tests").is_dir():
-                test_command = "python -m unittest discover tests"
-            else:
-                test_command = "python -m unittest discover ."
-        local(test_command, echo=True)
-    else:
-        printer.warning("Skipping tests")
+    # Refs created by the steps, which will be pushed if requested
+    release_refs = []
 
-    if prepare:
-        prepare_release(info)
+    try:
+        if test:
+            from .test import run_tests
 
-    if merge:
-        merge_to_target_branch(info)
+            with timer.span("run_tests", "step"):
+                run_tests(info, test_command, test_cache, test_jobs)
+        else:
+            printer.warning("Skipping tests")
 
-    if tag:
-        create_release_tag(info, merge)
+        benchmark_results = None
+        if benchmark:
+            from .benchmark import run_benchmarks
+
+            with timer.span("run_benchmarks", "step"):
+                benchmark_results = run_benchmarks(
+                    info,
+                    benchmark_command,
+                    benchmark_tolerance,
+                    tag_prefix,
+                    benchmark_runs,
+                    remote,
+                )
+
+        if prepare:
+            from .prepare import prepare_release
+
+            with timer.span("prepare_release", "step"):
+                prepare_release(info)
+            release_refs.append(f"refs/heads/{source_branch}")
+
+        if merge:
+            from .merge import merge_to_target_branch
+
+            with timer.span("merge_to_target_branch", "step"):
+                merge_to_target_branch(info)
+            release_refs.append(f"refs/heads/{target_branch}")
+
+        if tag:
+            from .tag import create_release_tag
+
+            with timer.span("create_release_tag", "step"):
+                create_release_tag(info, merge)
+            release_refs.append(f"refs/tags/{tag_name}")
+            if benchmark_results is not None:
+                from .benchmark import NOTES_REF, record_baseline
+
+                record_baseline(info, benchmark_results)
+                release_refs.append(NOTES_REF)
+
+        if build:
+            from .build import build_distributions
+
+            with timer.span("build_distributions", "step"):
+                build_distributions(info, build_command, repository)
+
+        if resume:
+            from .resume import resume_development
+
+            with timer.span("resume_development", "step"):
+                resume_development(info)
+            release_refs.append(f"refs/heads/{source_branch}")
+
+        if push:
+            from .push import push_release_refs
 
-    if resume:
-        resume_development(info)
+            release_refs = list(dict.fromkeys(release_refs))
+            with timer.span("push_release_refs", "step"):
+                push_release_refs(info, release_refs, remote)
+    finally:
+        if timings:
+            timer.print_summary()
+        if trace_file:
+            timer.write_trace(trace_file)
+            printer.info("Trace written to", trace_file)
@@ -1,7 +1,7 @@
-from runcommands.commands import local
-from runcommands.util import confirm, printer, prompt
+from runcommands.util import printer
 
-from .util import get_current_branch, print_step_header, update_line
+from .timing import confirm, local, prompt
+from .util import FileEdits, get_current_branch, print_step_header
 
 
 def resume_development(info):
@@ -13,9 +13,11 @@ def resume_development(info):
 
     current_branch = get_current_branch()
 
+    edits = FileEdits()
+
     if info.pyproject_file:
         quote = info.pyproject_version_quote
-        update_line(
+        edits.replace_line(
             info.pyproject_file,
             info.pyproject_version_line_number,
             f"version = {quote}{dev_version}{quote}",
@@ -23,25 +25,19 @@ def resume_development(info):
 
     if info.version_file:
         quote = info.version_quote
-        update_line(
+        edits.replace_line(
             info.version_file,
             info.version_line_number,
             f"__version__ = {quote}{dev_version}{quote}",
         )
 
-    new_change_log_lines = [
-        f"## {next_version} - unreleased\n\n",
-        "In progress...\n\n",
-    ]
-    with info.change_log.open() as fp:
-        lines = fp.readlines()
-    lines = (
-        lines[: info.change_log_line_number]
-        + new_change_log_lines
-        + lines[info.change_log_line_number :]
+    edits.insert_lines(
+        info.change_log,
+        info.change_log_line_number,
+        [f"## {next_version} - unreleased", "", "In progress...", ""],
     )
-    with info.change_log.open("w") as fp:
-        fp.writelines(lines)
+
+    edits.apply()
 
     commit_files = (info.pyproject_file, info.version_file, info.change_log)
     local(("git", "diff", *commit_files))
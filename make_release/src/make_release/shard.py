@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Assumed duration of test modules that have never been timed
+DEFAULT_DURATION = 1.0
+
+# Shards are run with the same interpreter as the default test command
+# (i.e., the package's environment rather than make-release's). This
+# module only uses the standard library, so it's run from its path via
+# runpy, and make-release doesn't need to be installed in that
+# environment. run_path() doesn't add this module's directory to
+# sys.path, so modules in it can't shadow the tests' imports.
+PYTHON = "python"
+BOOTSTRAP = (
+    "import runpy, sys; "
+    "sys.exit(runpy.run_path(sys.argv[1], run_name='shard')['main'](sys.argv[2:]))"
+)
+
+
+def discover_test_modules(start_dir, pattern="test*.py"):
+    """Find test modules in ``start_dir``.
+
+    Like ``unittest discover``, modules in subdirectories are only found
+    if every directory between ``start_dir`` and the module is a
+    package. Module names are relative to ``start_dir``.
+
+    .. note:: This is duplicated in ``com.wyattbaldwin.run_tests``. This
+        module can only use the standard library (see above), so it
+        can't share it. Keep the two in sync.
+
+    """
+    start_dir = pathlib.Path(start_dir)
+    names = []
+    for path in sorted(start_dir.rglob(pattern)):
+        parts = path.relative_to(start_dir).parts
+        if not all(part.isidentifier() for part in parts[:-1] + (path.stem,)):
+            continue
+        package_dir = start_dir
+        for part in parts[:-1]:
+            package_dir = package_dir / part
+            if not (package_dir / "__init__.py").is_file():
+                break
+        else:
+            names.append(".".join(parts[:-1] + (path.stem,)))
+    return names
+
+
+def make_shards(modules, durations, count):
+    """Distribute modules across shards, longest modules first.
+
+    Each module goes into the shard with the least total duration so
+    far. Modules without a recorded duration are assumed to take the
+    average recorded duration.
+
+    >>> durations = {"a": 4, "b": 3, "c": 2, "d": 2, "e": 1}
+    >>> make_shards(["a", "b", "c", "d", "e"], durations, 2)
+    [['a', 'd'], ['b', 'c', 'e']]
+    >>> make_shards(["a", "b"], {}, 4)
+    [['a'], ['b']]
+
+    """
+    known = [durations[m] for m in modules if m in durations]
+    default = sum(known) / len(known) if known else DEFAULT_DURATION
+    shards = [[] for _ in range(min(count, len(modules)))]
+    totals = [0.0] * len(shards)
+    ordered = sorted(modules, key=lambda m: durations.get(m, default), reverse=True)
+    for module in ordered:
+        index = totals.index(min(totals))
+        shards[index].append(module)
+        totals[index] += durations.get(module, default)
+    return shards
+
+
+class ShardRun:
+    """Run shards concurrently, each in its own process.
+
+    Output from each shard is captured and yielded as soon as the shard
+    finishes. When ``fail_fast`` is set, the remaining shards are
+    terminated as soon as one fails.
+
+    """
+
+    def __init__(self, start_dir, shards, fail_fast=True):
+        self.start_dir = pathlib.Path(start_dir)
+        self.shards = shards
+        self.fail_fast = fail_fast
+        self.durations = {}
+        self._procs = []
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def __iter__(self):
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as executor:
+            futures = [
+                executor.submit(self._run_shard, index, modules)
+                for index, modules in enumerate(self.shards)
+            ]
+            for future in as_completed(futures):
+                index, return_code, output, elapsed = future.result()
+                if return_code is None:
+                    continue
+                yield index, return_code, output, elapsed
+                if return_code and self.fail_fast:
+                    self.stop()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            for proc in self._procs:
+                if proc.poll() is None:
+                    proc.terminate()
+
+    def _run_shard(self, index, modules):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            durations_file = pathlib.Path(temp_dir) / "durations.json"
+            args = (
+                PYTHON,
+                "-c",
+                BOOTSTRAP,
+                __file__,
+                "--start-dir",
+                str(self.start_dir.resolve()),
+                "--durations-file",
+                str(durations_file),
+                *modules,
+            )
+            with self._lock:
+                if self._stopped:
+                    return index, None, "", 0
+                start = time.perf_counter()
+                proc = subprocess.Popen(
+                    args,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    universal_newlines=True,
+                )
+                self._procs.append(proc)
+            output, _ = proc.communicate()
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                if self._stopped and proc.returncode < 0:
+                    # Terminated because another shard failed
+                    return index, None, output, elapsed
+                if durations_file.is_file():
+                    with durations_file.open() as fp:
+                        self.durations.update(json.load(fp))
+            return index, proc.returncode, output, elapsed
+
+
+class TimedSuite(unittest.TestSuite):
+    """Test suite that records how long it takes to run."""
+
+    def __init__(self, name, tests, durations):
+        super().__init__(tests)
+        self.name = name
+        self.durations = durations
+
+    def run(self, result, debug=False):
+        start = time.perf_counter()
+        try:
+            return super().run(result, debug)
+        finally:
+            self.durations[self.name] = time.perf_counter() - start
+
+
+def main(argv=None):
+    """Run the specified test modules and record their durations."""
+    parser = argparse.ArgumentParser(prog="python -m make_release.shard")
+    parser.add_argument("--start-dir", default=".")
+    parser.add_argument("--durations-file")
+    parser.add_argument("modules", nargs="+")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.abspath(args.start_dir))
+
+    durations = {}
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for name in args.modules:
+        suite.addTest(TimedSuite(name, loader.loadTestsFromName(name), durations))
+
+    result = unittest.TextTestRunner(stream=sys.stdout).run(suite)
+
+    if args.durations_file:
+        with open(args.durations_file, "w") as fp:
+            json.dump(durations, fp)
+
+    return 0 if result.wasSuccessful() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
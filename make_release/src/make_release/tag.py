@@ -1,6 +1,7 @@
-from runcommands.commands import local
-from runcommands.util import abort, confirm, printer
+from runcommands.util import abort, printer
 
+from .changelog import ChangeLog
+from .timing import confirm, local
 from .util import get_current_branch, print_step_header
 
 
@@ -30,6 +31,9 @@ def create_release_tag(info, merge):
 
     if confirmed:
         msg = f"Release {info.name} {info.version}"
+        notes = ChangeLog(info.change_log).get_notes(info.version)
+        if notes:
+            msg = f"{msg}\n\n{notes}"
         local(("git", "tag", "-a", "-m", msg, info.tag_name))
 
     local(("git", "checkout", current_branch))
@@ -0,0 +1,167 @@
+import datetime
+import hashlib
+import os
+import pathlib
+import time
+
+from runcommands.util import abort, printer
+
+from .shard import ShardRun, discover_test_modules, make_shards
+from .timing import local, timer
+from .util import (
+    get_package_prefix,
+    print_step_header,
+    read_cache_file,
+    write_cache_file,
+)
+
+# Maximum number of passing test runs to remember
+TEST_CACHE_SIZE = 100
+
+
+def run_tests(info, test_command, use_cache=True, jobs=1):
+    print_step_header("Testing")
+
+    # When the default test command is used, the tests can be run in
+    # parallel shards instead, since the same tests will be run.
+    start_dir = None
+    if test_command is None:
+        if (pathlib.Path.cwd() / "tests").is_dir():
+            start_dir = "tests"
+        else:
+            start_dir = "."
+        test_command = f"python -m unittest discover {start_dir}"
+
+    prefix = get_package_prefix()
+    tree = get_test_tree(info.source_branch, prefix)
+    if tree is None:
+        cache_key = None
+    else:
+        cache_key = get_test_cache_key(prefix, tree, test_command)
+
+    if use_cache and cache_key is not None:
+        cache = read_test_cache()
+        entry = cache.get(cache_key)
+        if entry is not None:
+            printer.warning(
+                "Skipping tests; tree",
+                entry["tree"][:12],
+                "already passed on",
+                entry["date"],
+                "with command:",
+                test_command,
+            )
+            return
+
+    if start_dir is not None and jobs != 1:
+        run_test_shards(start_dir, jobs)
+    else:
+        local(test_command, echo=True)
+
+    if cache_key is not None:
+        cache = read_test_cache()
+        cache.pop(cache_key, None)
+        cache[cache_key] = {
+            "tree": tree,
+            "command": test_command,
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        write_test_cache(cache)
+
+
+def run_test_shards(start_dir, jobs):
+    """Run test modules in ``start_dir`` in parallel shards.
+
+    Modules are distributed across ``jobs`` shards (one per CPU when
+    ``jobs`` is 0) using the durations recorded for the package on
+    previous runs. Shards are run with ``python`` from ``PATH``, like
+    the default test command. The
+    output of each shard is shown as soon as it finishes. If any shard
+    fails, the others are stopped and the release is aborted.
+
+    """
+    modules = discover_test_modules(start_dir)
+    if not modules:
+        abort(9, f"No test modules found in {start_dir}")
+
+    # Durations are recorded per package since module names (e.g.,
+    # "tests") are often the same in different packages.
+    prefix = get_package_prefix()
+    all_durations = read_cache_file("test-durations.json")
+    durations = all_durations.get(prefix)
+    if not isinstance(durations, dict):
+        durations = {}
+
+    shards = make_shards(modules, durations, jobs or os.cpu_count() or 1)
+    run = ShardRun(start_dir, shards)
+    failed = None
+
+    printer.info(f"Running {len(modules)} test modules in {len(shards)} shards")
+    for index, return_code, output, elapsed in run:
+        end = time.perf_counter()
+        timer.add_span(f"shard {index + 1}", "subprocess", end - elapsed, end, index)
+        status = "failed" if return_code else "passed"
+        printer.print()
+        printer.header(
+            f"Shard {index + 1} of {len(shards)} {status} in {elapsed:.2f}s:",
+            ", ".join(shards[index]),
+        )
+        printer.print(output.rstrip())
+        if return_code and failed is None:
+            failed = index
+
+    durations.update(run.durations)
+    all_durations[prefix] = durations
+    write_cache_file("test-durations.json", all_durations)
+
+    if failed is not None:
+        abort(10, f"Tests failed in shard {failed + 1}")
+
+
+def get_test_tree(source_branch, prefix):
+    """Get hash of the package tree the tests will run against.
+
+    This is the tree of the package directory (``prefix``) on the source
+    branch, so changes to other packages in the repo don't invalidate
+    cached results. If the package directory has uncommitted changes or
+    doesn't match the source branch, the tests won't be running against
+    that tree, so ``None`` is returned to indicate that the result can't
+    be cached.
+
+    """
+    result = local(
+        ("git", "status", "--porcelain", "--untracked-files=no", "."),
+        stdout="capture",
+    )
+    if result.stdout.strip():
+        return None
+    tree = get_tree_hash(source_branch, prefix)
+    if get_tree_hash("HEAD", prefix) != tree:
+        return None
+    return tree
+
+
+def get_test_cache_key(prefix, tree, test_command):
+    """Get key for caching a passing test run of a package's tree.
+
+    The package path is included so that packages with identical trees
+    and the same test command don't share results.
+
+    """
+    data = f"{prefix}\0{tree}\0{test_command}".encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+def get_tree_hash(rev, prefix=""):
+    result = local(("git", "rev-parse", f"{rev}:{prefix}"), stdout="capture")
+    return result.stdout.strip()
+
+
+def read_test_cache():
+    return read_cache_file("test-cache.json")
+
+
+def write_test_cache(cache):
+    # Entries are kept in insertion order, so the oldest are dropped.
+    items = list(cache.items())[-TEST_CACHE_SIZE:]
+    write_cache_file("test-cache.json", dict(items))
@@ -0,0 +1,118 @@
+import json
+import os
+import shlex
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from runcommands.commands import local as _local
+from runcommands.util import confirm as _confirm
+from runcommands.util import flatten_args, printer
+from runcommands.util import prompt as _prompt
+
+Span = namedtuple("Span", ("name", "category", "start", "end", "thread"))
+
+
+class Timer:
+    """Record how long steps, subprocesses, and prompts take.
+
+    Spans are recorded with :meth:`span` (or :meth:`add_span` for things
+    that were timed elsewhere) and can be summarized via
+    :meth:`print_summary` or exported via :meth:`write_trace` in the
+    Chrome trace event format, which can be loaded into Perfetto or
+    ``chrome://tracing``.
+
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, category):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, category, start, time.perf_counter())
+
+    def add_span(self, name, category, start, end, thread=None):
+        if thread is None:
+            thread = threading.get_ident()
+        with self._lock:
+            self.spans.append(Span(name, category, start, end, thread))
+
+    def get_spans(self, category):
+        return [span for span in self.spans if span.category == category]
+
+    def print_summary(self, slowest=5):
+        total = time.perf_counter() - self.origin
+        printer.print("\n")
+        printer.header("Timing")
+        for span in self.get_spans("step"):
+            print_row(span.name, span.end - span.start)
+        for category, label in (("subprocess", "Commands"), ("input", "Input")):
+            spans = self.get_spans(category)
+            elapsed = sum(span.end - span.start for span in spans)
+            print_row(f"{label} ({len(spans)})", elapsed)
+        print_row("Total", total)
+        spans = self.get_spans("subprocess")
+        if spans:
+            spans = sorted(spans, key=lambda span: span.start - span.end)
+            printer.info("\nSlowest commands:")
+            for span in spans[:slowest]:
+                printer.print(f"{span.end - span.start:8.3f}s  {span.name}")
+
+    def write_trace(self, path):
+        """Write spans to file in Chrome trace event format."""
+        pid = os.getpid()
+        events = [
+            {
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": round((span.start - self.origin) * 1_000_000),
+                "dur": round((span.end - span.start) * 1_000_000),
+                "pid": pid,
+                "tid": span.thread,
+            }
+            for span in self.spans
+        ]
+        with open(path, "w") as fp:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+
+
+def print_row(label, elapsed):
+    printer.info(f"{label:<40}", end=" ", flush=True)
+    printer.print(f"{elapsed:8.3f}s")
+
+
+timer = Timer()
+
+
+# The following wrap the corresponding runcommands functions so that
+# all commands and prompts are timed.
+
+
+def local(args, *rest, **kwargs):
+    if isinstance(args, str):
+        name = args
+    else:
+        name = " ".join(shlex.quote(str(arg)) for arg in flatten_args(args))
+    with timer.span(name, "subprocess"):
+        return _local(args, *rest, **kwargs)
+
+
+def confirm(*args, **kwargs):
+    with timer.span("confirm", "input"):
+        return _confirm(*args, **kwargs)
+
+
+def prompt(*args, **kwargs):
+    with timer.span("prompt", "input"):
+        return _prompt(*args, **kwargs)
@@ -1,10 +1,17 @@
+import functools
+import json
+import os
 import pathlib
 import re
+import shutil
+import tempfile
 from collections import namedtuple
 
-from runcommands.commands import local
 from runcommands.util import abort, printer
 
+from .refs import get_git_refs
+from .timing import local
+
 ReleaseInfo = namedtuple(
     "ReleaseInfo",
     (
@@ -37,37 +44,6 @@ def find_change_log():
     abort(6, f"Could not find change log; tried {', '.join(change_log_candidates)}")
 
 
-def find_change_log_section(change_log, version):
-    # Find the first line that starts with '##'. Extract the version and
-    # date from that line. The version must be the specified release
-    # version OR the date must be the literal string 'unreleased'.
-
-    # E.g.: ## 1.0.0 - unreleased
-    change_log_header_re = r"^## (?P<version>.+) - (?P<date>.+)$"
-
-    with change_log.open() as fp:
-        for line_number, line in enumerate(fp):
-            match = re.search(change_log_header_re, line)
-            if match:
-                found_version = match.group("version")
-                found_date = match.group("date")
-                if found_version == version:
-                    if found_date != "unreleased":
-                        printer.warning("Re-releasing", version)
-                elif found_date == "unreleased":
-                    if found_version != version:
-                        printer.warning("Replacing", found_version, "with", version)
-                else:
-                    msg = (
-                        f"Expected version {version} or release date "
-                        f'"unreleased"; got:\n\n    {line}'
-                    )
-                    abort(7, msg)
-                return line_number
-
-    abort(8, "Could not find section in change log")
-
-
 def find_line_ending(line):
     candidates = ("\r\n", "\n", "\r")
     for candidate in candidates:
@@ -76,23 +52,65 @@ def find_line_ending(line):
     raise ValueError(r"Line doesn't end with a known line ending: \r\n, \n, or \r")
 
 
-def find_version_file():
+def find_version_file(package_name=None):
     # Try to find __version__ in:
     #
     # - package/__init__.py
     # - namespace_package/package/__init__.py
     # - src/package/__init__.py
     # - src/namespace_package/package/__init__.py
+    #
+    # The location is recorded in an index in the cache so subsequent
+    # runs only need to stat the file to know it's still valid. Files
+    # in packages matching the package name are checked first so that
+    # vendored packages aren't mistaken for the project's package.
     cwd = pathlib.Path.cwd()
+    index = read_cache_file("version-index.json")
+    entry = index.get(str(cwd))
+    if entry is not None:
+        candidate = cwd / entry["path"]
+        try:
+            stat = candidate.stat()
+        except FileNotFoundError:
+            pass
+        else:
+            if [stat.st_mtime_ns, stat.st_size] == entry["stat"]:
+                return (
+                    candidate,
+                    entry["line_number"],
+                    entry["quote"],
+                    entry["version"],
+                )
+
     candidates = []
     candidates.extend(cwd.glob("*/__init__.py"))
     candidates.extend(cwd.glob("*/*/__init__.py"))
     candidates.extend(cwd.glob("src/*/__init__.py"))
     candidates.extend(cwd.glob("src/*/*/__init__.py"))
+    candidates = [
+        candidate
+        for candidate in candidates
+        if not any(part.startswith(".") for part in candidate.relative_to(cwd).parts)
+    ]
+    if package_name:
+        package_name = package_name.replace("-", "_")
+        candidates.sort(key=lambda candidate: candidate.parent.name != package_name)
+
     for candidate in candidates:
         result = get_current_version(candidate, "__version__", False)
         if result is not None:
+            stat = candidate.stat()
+            line_number, quote, version = result
+            index[str(cwd)] = {
+                "path": str(candidate.relative_to(cwd)),
+                "stat": [stat.st_mtime_ns, stat.st_size],
+                "line_number": line_number,
+                "quote": quote,
+                "version": version,
+            }
+            write_cache_file("version-index.json", index)
             return (candidate,) + result
+
     candidates = "\n    ".join(str(candidate) for candidate in candidates)
     printer.warning(
         f"Could not find file containing __version__; tried:\n    {candidates}",
@@ -100,37 +118,134 @@ def find_version_file():
     return None
 
 
+def get_package_prefix():
+    """Get path of package directory relative to repo root.
+
+    This is empty when the package is at the root of the repo.
+
+    """
+    result = local("git rev-parse --show-prefix", stdout="capture")
+    return result.stdout.strip().rstrip("/")
+
+
+def get_cache_dir():
+    """Get directory where data is cached between runs.
+
+    The cache lives in the git directory so it's shared between
+    worktrees and never shows up as untracked files.
+
+    """
+    refs = get_git_refs()
+    if refs is not None:
+        git_dir = refs.common_dir
+    else:
+        result = local("git rev-parse --git-common-dir", stdout="capture")
+        git_dir = pathlib.Path(result.stdout.strip()).resolve()
+    path = git_dir / "make-release"
+    path.mkdir(exist_ok=True)
+    return path
+
+
+def read_cache_file(name):
+    """Read JSON data from file in cache; returns {} if not present."""
+    path = get_cache_dir() / name
+    try:
+        with path.open() as fp:
+            data = json.load(fp)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def write_cache_file(name, data):
+    path = get_cache_dir() / name
+    with path.open("w") as fp:
+        json.dump(data, fp, indent=4)
+
+
 def get_current_branch():
+    refs = get_git_refs()
+    if refs is not None:
+        return refs.current_branch()
     result = local("git rev-parse --abbrev-ref HEAD", stdout="capture")
     return result.stdout.strip()
 
 
-def get_latest_tag():
-    result = local("git rev-list --tags --max-count=1", stdout="capture")
-    revision = result.stdout.strip()
-    result = local(("git", "describe", "--tags", revision), stdout="capture")
-    tag = result.stdout.strip()
-    return tag
+def ref_exists(ref):
+    """Check whether the fully qualified ``ref`` exists."""
+    refs = get_git_refs()
+    if refs is not None:
+        return refs.exists(ref)
+    result = local(
+        ("git", "rev-parse", "--verify", "--quiet", ref),
+        stdout="capture",
+        raise_on_error=False,
+    )
+    return result.succeeded
+
+
+def get_latest_tag(prefix=None):
+    """Get the most recently created tag, optionally limited to prefix.
+
+    For example, in a monorepo with tags like ``{name}-{version}``, pass
+    ``prefix="{name}-"`` to get the latest tag for a given package.
 
+    Tags are sorted by creation date (the tagger date for annotated tags
+    or the commit date for lightweight tags), with ties broken by
+    version. ``for-each-ref`` only has to read the refs, unlike
+    ``rev-list --tags``, which walks the history of every tag.
 
-def get_current_version(file, name, abort_on_not_found=True):
+    Returns ``None`` if there are no matching tags.
+
+    """
+    result = local(
+        (
+            "git",
+            "for-each-ref",
+            "--count=1",
+            "--format=%(refname:strip=2)",
+            "--sort=-v:refname",
+            "--sort=-creatordate",
+            f"refs/tags/{prefix}*" if prefix else "refs/tags",
+        ),
+        stdout="capture",
+    )
+    return result.stdout.strip() or None
+
+
+def get_current_version(file, name="__version__", abort_on_not_found=True):
     # Extract current version from __version__ in version file.
     #
     # E.g.: __version__ = '1.0.dev0'
-    version_re = (
-        rf"""^{name}"""
-        r""" *= *"""
-        r"""(?P<quote>['"])((?P<version>.+?)(?P<dev_marker>\.dev\d+)?)?\1 *$"""
-    )
+    version_re = get_version_re(name)
     with file.open() as fp:
         for line_number, line in enumerate(fp):
-            match = re.search(version_re, line)
+            # Skip the regex for lines that obviously don't match
+            if not line.startswith(name):
+                continue
+            match = version_re.search(line)
             if match:
                 return line_number, match.group("quote"), match.group("version")
     if abort_on_not_found:
         abort(4, f"Could not find {name} in {file}")
 
 
+@functools.lru_cache()
+def get_version_re(name):
+    """Get compiled regex for matching ``name = "version"`` lines.
+
+    >>> match = get_version_re("__version__").search('__version__ = "1.0.dev0"')
+    >>> match.group("quote"), match.group("version")
+    ('"', '1.0')
+
+    """
+    return re.compile(
+        rf"""^{re.escape(name)}"""
+        r""" *= *"""
+        r"""(?P<quote>['"])((?P<version>.+?)(?P<dev_marker>\.dev\d+)?)?\1 *$"""
+    )
+
+
 def get_next_version(current_version):
     """Get next version based on current version.
 
@@ -264,15 +379,139 @@ def update_line(path, line_to_update, new_content):
     Do *not* include the trailing newline--the line ending of the
     existing line will be appended automatically.
 
+    To make several edits, use :class:`FileEdits` instead so that each
+    file is only rewritten once.
+
     """
-    lines = []
-    with path.open("r", newline="") as fp:
-        for line_number, line in enumerate(fp):
-            if line_number == line_to_update:
-                lines.append(new_content)
-                lines.append(find_line_ending(line))
-            else:
-                lines.append(line)
-    assert all(str(item) for item in lines), repr(lines)
-    with path.open("w", newline="") as fp:
-        fp.writelines(lines)
+    edits = FileEdits()
+    edits.replace_line(path, line_to_update, new_content)
+    edits.apply()
+
+
+class FileEdits:
+    """Collect line edits to a group of files and apply them together.
+
+    All the edits to a given file are applied in a single streaming
+    pass that writes to a temporary file next to the original. Once all
+    the temporary files have been written, they're renamed over the
+    originals. If anything fails along the way, the originals are left
+    in place (or restored from backups if some were already replaced),
+    so either all the edits are applied or none of them are.
+
+    Line numbers are zero-based and always refer to lines in the
+    original file, regardless of other edits to the same file. As with
+    :func:`update_line`, new content should *not* include line endings;
+    the line ending used in the file will be appended automatically.
+
+    """
+
+    def __init__(self):
+        # path -> line number -> [replacement or None, inserted lines]
+        self.edits = {}
+
+    def _get_line_edits(self, path, line_number):
+        # Resolve so that different spellings of the same path (e.g.,
+        # relative and absolute) share one set of edits.
+        path = pathlib.Path(path).resolve()
+        file_edits = self.edits.setdefault(path, {})
+        return file_edits.setdefault(line_number, [None, []])
+
+    def replace_line(self, path, line_number, new_content):
+        """Replace the specified line with new content."""
+        self._get_line_edits(path, line_number)[0] = new_content
+
+    def insert_lines(self, path, line_number, new_lines):
+        """Insert lines before the specified line.
+
+        Passing the number of lines in the file as the line number will
+        append the new lines to the end of the file.
+
+        """
+        self._get_line_edits(path, line_number)[1].extend(new_lines)
+
+    def apply(self):
+        temp_paths = {}
+        try:
+            for path, file_edits in self.edits.items():
+                temp_paths[path] = self._write_temp_file(path, file_edits)
+            self._replace_files(temp_paths)
+        finally:
+            for temp_path in temp_paths.values():
+                if temp_path.exists():
+                    temp_path.unlink()
+        self.edits.clear()
+
+    def _write_temp_file(self, path, file_edits):
+        fd, temp_path = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+        temp_path = pathlib.Path(temp_path)
+        try:
+            # The fd is wrapped first so it's closed if anything fails
+            with open(fd, "w", newline="") as out_fp, path.open(
+                "r", newline=""
+            ) as in_fp:
+                shutil.copymode(path, temp_path)
+                line_ending = "\n"
+                line_number = -1
+                line = ""
+                for line_number, line in enumerate(in_fp):
+                    line_ending = _get_line_ending(line) or line_ending
+                    replacement, inserted_lines = file_edits.get(
+                        line_number, (None, ())
+                    )
+                    for inserted_line in inserted_lines:
+                        out_fp.write(f"{inserted_line}{line_ending}")
+                    if replacement is None:
+                        out_fp.write(line)
+                    else:
+                        out_fp.write(f"{replacement}{_get_line_ending(line)}")
+                line_count = line_number + 1
+                # When appending, the last line needs a line ending
+                needs_line_ending = line_count and not _get_line_ending(line)
+                for line_number in sorted(file_edits):
+                    replacement, inserted_lines = file_edits[line_number]
+                    if line_number < line_count:
+                        continue
+                    if line_number > line_count or replacement is not None:
+                        raise IndexError(
+                            f"Line {line_number} is past the end of {path} "
+                            f"({line_count} lines)"
+                        )
+                    if inserted_lines and needs_line_ending:
+                        out_fp.write(line_ending)
+                    for inserted_line in inserted_lines:
+                        out_fp.write(f"{inserted_line}{line_ending}")
+        except BaseException:
+            temp_path.unlink()
+            raise
+        return temp_path
+
+    def _replace_files(self, temp_paths):
+        backups = []
+        replaced = []
+        try:
+            for path, temp_path in temp_paths.items():
+                backup_path = path.with_name(f".{path.name}.backup")
+                if backup_path.exists():
+                    backup_path.unlink()
+                try:
+                    os.link(path, backup_path)
+                except OSError:
+                    shutil.copy2(path, backup_path)
+                backups.append(backup_path)
+                os.replace(temp_path, path)
+                replaced.append((path, backup_path))
+        except BaseException:
+            for path, backup_path in reversed(replaced):
+                os.replace(backup_path, path)
+            raise
+        finally:
+            for backup_path in backups:
+                if backup_path.exists():
+                    backup_path.unlink()
+
+
+def _get_line_ending(line):
+    try:
+        return find_line_ending(line)
+    except ValueError:
+        return ""
@@ -1,8 +1,733 @@
 import doctest
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import types
+import unittest
+import unittest.mock
 
-from make_release import util
+from runcommands.exc import RunAborted
+from runcommands.result import Result
+
+from make_release import (
+    __version__,
+    benchmark,
+    build,
+    changelog,
+    merge,
+    preflight,
+    push,
+    refs,
+    shard,
+    test,
+    timing,
+    util,
+)
 
 
 def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocTestSuite(benchmark))
+    tests.addTests(doctest.DocTestSuite(shard))
     tests.addTests(doctest.DocTestSuite(util))
     return tests
+
+
+def git(*args, cwd=None):
+    result = subprocess.run(
+        ("git",) + args,
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip()
+
+
+class GitRepoTestCase(unittest.TestCase):
+    """Run each test in a fresh git repo with a single commit."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.repo_dir = pathlib.Path(self.temp_dir.name) / "repo"
+        self.repo_dir.mkdir()
+        original_dir = os.getcwd()
+        os.chdir(self.repo_dir)
+        self.addCleanup(os.chdir, original_dir)
+        git("init", "--quiet", "--initial-branch=dev")
+        git("config", "user.name", "Test")
+        git("config", "user.email", "test@example.com")
+        self.write_file("README.md", "# Test\n")
+        git("add", "README.md")
+        git("commit", "--quiet", "-m", "Initial commit")
+
+    def write_file(self, name, content):
+        path = self.repo_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+        return path
+
+
+class TestCacheTests(GitRepoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.info = types.SimpleNamespace(source_branch="dev")
+        self.counter = self.repo_dir.parent / "counter"
+        self.command = f"echo run >> {self.counter}"
+
+    def get_run_count(self):
+        return len(self.counter.read_text().splitlines())
+
+    def test_passing_run_is_cached(self):
+        test.run_tests(self.info, self.command)
+        test.run_tests(self.info, self.command)
+        self.assertEqual(self.get_run_count(), 1)
+
+    def test_cache_is_keyed_by_tree(self):
+        test.run_tests(self.info, self.command)
+        self.write_file("README.md", "# Changed\n")
+        git("commit", "--quiet", "-am", "Change")
+        test.run_tests(self.info, self.command)
+        self.assertEqual(self.get_run_count(), 2)
+
+    def test_dirty_tree_is_not_cached(self):
+        self.write_file("README.md", "# Changed\n")
+        test.run_tests(self.info, self.command)
+        test.run_tests(self.info, self.command)
+        self.assertEqual(self.get_run_count(), 2)
+
+    def test_cache_can_be_bypassed(self):
+        test.run_tests(self.info, self.command)
+        test.run_tests(self.info, self.command, use_cache=False)
+        self.assertEqual(self.get_run_count(), 2)
+
+    def test_cache_is_keyed_by_package(self):
+        self.write_file("a/README.md", "# A\n")
+        self.write_file("b/README.md", "# B\n")
+        git("add", "a", "b")
+        git("commit", "--quiet", "-m", "Add packages")
+        os.chdir(self.repo_dir / "a")
+        test.run_tests(self.info, self.command)
+        os.chdir(self.repo_dir / "b")
+        test.run_tests(self.info, self.command)
+        self.assertEqual(self.get_run_count(), 2)
+        # Changes to other packages don't invalidate the cache
+        self.write_file("b/README.md", "# Changed\n")
+        git("commit", "--quiet", "-am", "Change b")
+        os.chdir(self.repo_dir / "a")
+        test.run_tests(self.info, self.command)
+        self.assertEqual(self.get_run_count(), 2)
+
+
+class ShardTests(GitRepoTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ("test_a", "test_b", "test_c"):
+            self.write_file(f"tests/{name}.py", PASSING_TEST_MODULE)
+        self.write_file("tests/pkg/__init__.py", "")
+        self.write_file("tests/pkg/test_d.py", PASSING_TEST_MODULE)
+        self.write_file("tests/not_a_pkg/test_e.py", PASSING_TEST_MODULE)
+        # Shards must not need make_release to be importable
+        patcher = unittest.mock.patch.dict(os.environ, {"PYTHONPATH": ""})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_discover_test_modules(self):
+        modules = shard.discover_test_modules("tests")
+        self.assertEqual(modules, ["pkg.test_d", "test_a", "test_b", "test_c"])
+
+    def test_run_test_shards(self):
+        test.run_test_shards("tests", 2)
+        path = util.get_cache_dir() / "test-durations.json"
+        with path.open() as fp:
+            durations = json.load(fp)
+        self.assertEqual(
+            set(durations[""]), {"pkg.test_d", "test_a", "test_b", "test_c"}
+        )
+
+    def test_failing_shard_aborts(self):
+        self.write_file("tests/test_b.py", FAILING_TEST_MODULE)
+        with self.assertRaises(RunAborted):
+            test.run_test_shards("tests", 2)
+
+
+class FileEditsTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.dir = pathlib.Path(self.temp_dir.name)
+        self.a = self.dir / "a.txt"
+        self.b = self.dir / "b.txt"
+        self.a.write_bytes(b"one\r\ntwo\r\nthree\r\n")
+        self.b.write_bytes(b"1\n2\n")
+
+    def test_edits_are_applied_in_one_pass(self):
+        edits = util.FileEdits()
+        edits.replace_line(self.a, 0, "ONE")
+        edits.replace_line(self.a, 2, "THREE")
+        edits.insert_lines(self.a, 1, ["one and a half"])
+        edits.insert_lines(self.b, 2, ["3", "4"])
+        edits.apply()
+        self.assertEqual(
+            self.a.read_bytes(), b"ONE\r\none and a half\r\ntwo\r\nTHREE\r\n"
+        )
+        self.assertEqual(self.b.read_bytes(), b"1\n2\n3\n4\n")
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()), ["a.txt", "b.txt"])
+
+    def test_invalid_edit_leaves_files_untouched(self):
+        edits = util.FileEdits()
+        edits.replace_line(self.a, 0, "ONE")
+        edits.replace_line(self.b, 5, "6")
+        with self.assertRaises(IndexError):
+            edits.apply()
+        self.assertEqual(self.a.read_bytes(), b"one\r\ntwo\r\nthree\r\n")
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()), ["a.txt", "b.txt"])
+
+    def test_failed_replace_rolls_back(self):
+        edits = util.FileEdits()
+        edits.replace_line(self.a, 0, "ONE")
+        edits.replace_line(self.b, 0, "ONE")
+        replace = os.replace
+
+        def fail_on_b(src, dst):
+            if pathlib.Path(dst) == self.b:
+                raise OSError("Simulated failure")
+            replace(src, dst)
+
+        with unittest.mock.patch("os.replace", fail_on_b):
+            with self.assertRaises(OSError):
+                edits.apply()
+        self.assertEqual(self.a.read_bytes(), b"one\r\ntwo\r\nthree\r\n")
+        self.assertEqual(self.b.read_bytes(), b"1\n2\n")
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()), ["a.txt", "b.txt"])
+
+    def test_failed_write_cleans_up_temp_file(self):
+        edits = util.FileEdits()
+        edits.replace_line(self.a, 0, "ONE")
+        fds = []
+        mkstemp = tempfile.mkstemp
+
+        def record_fd(*args, **kwargs):
+            fd, path = mkstemp(*args, **kwargs)
+            fds.append(fd)
+            return fd, path
+
+        with unittest.mock.patch("tempfile.mkstemp", record_fd):
+            with unittest.mock.patch("shutil.copymode", side_effect=OSError):
+                with self.assertRaises(OSError):
+                    edits.apply()
+        self.assertEqual(len(fds), 1)
+        self.assertRaises(OSError, os.fstat, fds[0])
+        self.assertEqual(self.a.read_bytes(), b"one\r\ntwo\r\nthree\r\n")
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()), ["a.txt", "b.txt"])
+
+    def test_edits_to_same_file_via_different_paths_are_combined(self):
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.dir)
+        edits = util.FileEdits()
+        edits.replace_line("a.txt", 0, "ONE")
+        edits.replace_line(self.dir / "." / "a.txt", 2, "THREE")
+        edits.apply()
+        self.assertEqual(self.a.read_bytes(), b"ONE\r\ntwo\r\nTHREE\r\n")
+
+    def test_append_to_file_without_trailing_newline(self):
+        self.a.write_bytes(b"one\r\ntwo")
+        edits = util.FileEdits()
+        edits.insert_lines(self.a, 2, ["three"])
+        edits.apply()
+        self.assertEqual(self.a.read_bytes(), b"one\r\ntwo\r\nthree\r\n")
+
+
+class FindVersionFileTests(GitRepoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_file("aaa_vendored/__init__.py", '__version__ = "0.1"\n')
+        self.write_file("src/pkg/__init__.py", '"""Package."""\n__version__ = "1.0"\n')
+
+    def test_package_matching_name_is_preferred(self):
+        path, line_number, quote, version = util.find_version_file("pkg")
+        self.assertEqual(path, self.repo_dir / "src/pkg/__init__.py")
+        self.assertEqual((line_number, quote, version), (1, '"', "1.0"))
+
+    def test_index_is_used_until_file_changes(self):
+        util.find_version_file("pkg")
+        with unittest.mock.patch.object(util, "get_current_version") as mock:
+            result = util.find_version_file("pkg")
+        mock.assert_not_called()
+        self.assertEqual(result[3], "1.0")
+        self.write_file("src/pkg/__init__.py", '__version__ = "2.0"\n')
+        result = util.find_version_file("pkg")
+        self.assertEqual(result[1:], (0, '"', "2.0"))
+
+
+class GetLatestTagTests(GitRepoTestCase):
+    def tag(self, name, date):
+        env = dict(os.environ, GIT_COMMITTER_DATE=date)
+        subprocess.run(("git", "tag", "-a", "-m", name, name), check=True, env=env)
+
+    def test_get_latest_tag(self):
+        self.assertIsNone(util.get_latest_tag())
+        self.tag("a-1.1", "2020-01-03T00:00:00")
+        self.tag("a-1.0", "2020-01-01T00:00:00")
+        self.tag("b-1.0", "2020-01-04T00:00:00")
+        self.tag("a-1.2", "2020-01-03T00:00:00")
+        self.assertEqual(util.get_latest_tag(), "b-1.0")
+        self.assertEqual(util.get_latest_tag("a-"), "a-1.2")
+        self.assertEqual(util.get_latest_tag("b-"), "b-1.0")
+        self.assertIsNone(util.get_latest_tag("c-"))
+
+
+class TimerTests(unittest.TestCase):
+    def test_write_trace(self):
+        timer = timing.Timer()
+        with timer.span("step", "step"):
+            with timer.span("command", "subprocess"):
+                pass
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = pathlib.Path(temp_dir) / "trace.json"
+            timer.write_trace(path)
+            with path.open() as fp:
+                trace = json.load(fp)
+        events = trace["traceEvents"]
+        self.assertEqual([e["name"] for e in events], ["command", "step"])
+        self.assertEqual({e["ph"] for e in events}, {"X"})
+        command, step = events
+        self.assertGreaterEqual(command["ts"], step["ts"])
+        self.assertLessEqual(command["dur"], step["dur"])
+
+    def test_local_is_timed(self):
+        timing.timer.reset()
+        timing.local(("true", ("--a", None)), raise_on_error=False)
+        (span,) = timing.timer.get_spans("subprocess")
+        self.assertEqual(span.name, "true --a")
+
+
+class ChangeLogTests(GitRepoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = self.write_file(
+            "CHANGELOG.md",
+            "# Change Log\n"
+            "\n"
+            "## 1.2 - unreleased\n"
+            "\n"
+            "In progress...\n"
+            "\n"
+            "## 1.1 - 2020-02-01\n"
+            "\n"
+            "- Added ß\n"
+            "\n"
+            "## 1.0 - 2020-01-01\n"
+            "\n"
+            "- Initial\n",
+        )
+
+    def test_sections(self):
+        change_log = changelog.ChangeLog(self.path)
+        self.assertEqual(
+            [(s.version, s.date, s.line_number) for s in change_log.sections],
+            [
+                ("1.2", "unreleased", 2),
+                ("1.1", "2020-02-01", 6),
+                ("1.0", "2020-01-01", 10),
+            ],
+        )
+        self.assertEqual(changelog.find_change_log_section(self.path, "1.2"), 2)
+
+    def test_get_notes(self):
+        change_log = changelog.ChangeLog(self.path)
+        self.assertEqual(change_log.get_notes("1.1"), "- Added ß")
+        self.assertEqual(change_log.get_notes("1.0"), "- Initial")
+        self.assertIsNone(change_log.get_notes("0.9"))
+
+    def test_index_is_cached_until_file_changes(self):
+        changelog.ChangeLog(self.path)
+        with unittest.mock.patch.object(changelog.ChangeLog, "_scan") as mock:
+            changelog.ChangeLog(self.path)
+        mock.assert_not_called()
+        with self.path.open("a") as fp:
+            fp.write("\n## 0.9 - 2019-01-01\n")
+        change_log = changelog.ChangeLog(self.path)
+        self.assertEqual(change_log.sections[-1].version, "0.9")
+        self.assertEqual(change_log.validate(), [])
+
+    def test_validate(self):
+        self.write_file(
+            "CHANGELOG.md",
+            "## 1.2 - 2020-01-01\n"
+            "## 1.1 - unreleased\n"
+            "## 1.0 - 2020-02-01\n"
+            "## 1.0 - 2019-01-01\n",
+        )
+        problems = changelog.ChangeLog(self.path).validate()
+        self.assertEqual(len(problems), 3)
+        self.assertIn("CHANGELOG.md:2: Only the first section", problems[0])
+        self.assertIn("CHANGELOG.md:3: Release date 2020-02-01", problems[1])
+        self.assertIn("CHANGELOG.md:4: Duplicate version: 1.0", problems[2])
+
+
+class PreflightTests(GitRepoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_file("CHANGELOG.md", "## 1.0 - unreleased\n")
+        git("add", "CHANGELOG.md")
+        git("commit", "--quiet", "-m", "Add change log")
+        self.info = types.SimpleNamespace(
+            source_branch="dev",
+            target_branch="main",
+            tag_name="1.0",
+            change_log=self.repo_dir / "CHANGELOG.md",
+        )
+
+    def test_no_problems(self):
+        git("branch", "main", "HEAD~1")
+        self.assertEqual(preflight.run_preflight_checks(self.info, True, True), [])
+
+    def test_all_problems_are_reported(self):
+        git("tag", "1.0")
+        self.write_file("README.md", "# Changed\n")
+        self.write_file("CHANGELOG.md", "## 1.0 - unreleased\n## 1.0 - unreleased\n")
+        problems = preflight.run_preflight_checks(self.info, True, True, False)
+        self.assertEqual(len(problems), 5, problems)
+        self.assertTrue(problems[0].startswith("Working tree has uncommitted changes"))
+        self.assertIn("Branch does not exist: main", problems)
+        self.assertIn("Tag already exists: 1.0", problems)
+
+    def test_nothing_to_merge(self):
+        git("branch", "main")
+        problems = preflight.run_preflight_checks(self.info, True, False, False)
+        self.assertEqual(problems, ["No changes to merge from dev into main"])
+        # The prepare step always creates a commit to merge
+        problems = preflight.run_preflight_checks(self.info, True, False, True)
+        self.assertEqual(problems, [])
+
+    def test_build_without_tag(self):
+        problems = preflight.run_preflight_checks(self.info, False, False, build=True)
+        self.assertEqual(
+            problems, ["Tag does not exist (needed to build without tagging): 1.0"]
+        )
+        git("tag", "1.0")
+        problems = preflight.run_preflight_checks(self.info, False, False, build=True)
+        self.assertEqual(problems, [])
+
+
+class MergeTests(GitRepoTestCase):
+    def test_merge_without_confirmation(self):
+        git("branch", "main")
+        self.write_file("README.md", "# Changed\n")
+        git("add", "README.md")
+        git("commit", "--quiet", "-m", "Change README")
+        info = types.SimpleNamespace(
+            name="pkg",
+            source_branch="dev",
+            target_branch="main",
+            version="1.0",
+            confirmation_required=False,
+        )
+        with unittest.mock.patch.object(merge, "prompt", lambda msg, default: default):
+            merge.merge_to_target_branch(info)
+        self.assertEqual(git("rev-parse", "--abbrev-ref", "HEAD"), "dev")
+        self.assertEqual(
+            git("log", "-1", "--format=%s", "main"),
+            "Merge branch 'dev' for pkg release 1.0",
+        )
+
+
+class GitRefsTests(GitRepoTestCase):
+    def test_loose_refs(self):
+        git("tag", "1.0")
+        git_refs = refs.GitRefs.find(".")
+        self.assertEqual(git_refs.current_branch(), "dev")
+        self.assertEqual(git_refs.resolve("HEAD"), git("rev-parse", "HEAD"))
+        self.assertEqual(git_refs.resolve("refs/tags/1.0"), git("rev-parse", "HEAD"))
+        self.assertFalse(git_refs.exists("refs/heads/main"))
+
+    def test_packed_refs(self):
+        git("tag", "-a", "-m", "1.0", "1.0")
+        git("branch", "main")
+        git("pack-refs", "--all")
+        git_refs = refs.GitRefs.find(".")
+        self.assertEqual(git_refs.resolve("refs/tags/1.0"), git("rev-parse", "1.0"))
+        self.assertTrue(git_refs.exists("refs/heads/main"))
+        git("branch", "-D", "main")
+        self.assertFalse(git_refs.exists("refs/heads/main"))
+
+    def test_detached_head(self):
+        git("checkout", "--quiet", "--detach")
+        git_refs = refs.GitRefs.find(".")
+        self.assertEqual(git_refs.current_branch(), "HEAD")
+
+    def test_worktree(self):
+        worktree_dir = self.repo_dir.parent / "worktree"
+        git("worktree", "add", "--quiet", "-b", "feature", str(worktree_dir))
+        git_refs = refs.GitRefs.find(worktree_dir / "sub" / "dir")
+        self.assertEqual(git_refs.current_branch(), "feature")
+        self.assertTrue(git_refs.exists("refs/heads/dev"))
+        self.assertEqual(git_refs.common_dir, (self.repo_dir / ".git").resolve())
+
+    def test_unsupported_layout(self):
+        with unittest.mock.patch.dict(os.environ, {"GIT_DIR": ".git"}):
+            self.assertIsNone(refs.GitRefs.find("."))
+
+
+class StartupTests(unittest.TestCase):
+    # Budget for importing make_release modules when showing the version
+    budget_us = 50_000
+
+    def test_show_version_startup(self):
+        result = subprocess.run(
+            (sys.executable, "-X", "importtime", "-m", "make_release", "-s"),
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(result.stdout, f"make-release version {__version__}\n")
+        # Lines look like "import time: <self> | <cumulative> | <module>"
+        imports = {}
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and "[us]" not in line:
+                _, cumulative, module = line[len("import time:") :].split("|")
+                imports[module.strip()] = int(cumulative)
+        self.assertNotIn("runcommands", imports)
+        self.assertNotIn("make_release.release", imports)
+        elapsed = sum(
+            cumulative
+            for module, cumulative in imports.items()
+            if module.startswith("make_release")
+        )
+        self.assertLess(elapsed, self.budget_us)
+
+
+class BuildTests(GitRepoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_file("pkg/pyproject.toml", "")
+        git("add", "pkg")
+        git("commit", "--quiet", "-m", "Add package")
+        git("tag", "pkg-1.0")
+        os.chdir(self.repo_dir / "pkg")
+        self.info = types.SimpleNamespace(
+            name="pkg",
+            version="1.0",
+            tag_name="pkg-1.0",
+            confirmation_required=False,
+        )
+        self.log = self.repo_dir.parent / "build.log"
+        # Fake build command that records the directory it's run in
+        self.build_command = (
+            f"pwd >> {self.log} && mkdir -p {{outdir}} && "
+            "touch {outdir}/pkg-1.0.{format}"
+        )
+
+    def test_build_and_publish(self):
+        repository = self.repo_dir.parent / "index"
+        distributions = build.build_distributions(
+            self.info, self.build_command, str(repository)
+        )
+        self.assertEqual(
+            [path.name for path in distributions], ["pkg-1.0.sdist", "pkg-1.0.wheel"]
+        )
+        # Each distribution is built in its own worktree
+        build_dirs = sorted(self.log.read_text().splitlines())
+        self.assertEqual(len(build_dirs), 2)
+        self.assertTrue(build_dirs[0].endswith("/worktree-sdist/pkg"))
+        self.assertTrue(build_dirs[1].endswith("/worktree-wheel/pkg"))
+        self.assertEqual(
+            sorted(path.name for path in repository.iterdir()),
+            ["pkg-1.0.sdist", "pkg-1.0.wheel"],
+        )
+        self.assertEqual(git("worktree", "list").count("\n"), 0)
+
+    def test_build_is_cached_by_tree(self):
+        build.build_distributions(self.info, self.build_command)
+        build.build_distributions(self.info, self.build_command)
+        self.assertEqual(len(self.log.read_text().splitlines()), 2)
+        # Changes outside the package don't affect its tree hash
+        self.write_file("other.txt", "")
+        git("add", "../other.txt")
+        git("commit", "--quiet", "-m", "Change outside package")
+        git("tag", "pkg-1.1")
+        self.info.tag_name = "pkg-1.1"
+        build.build_distributions(self.info, self.build_command)
+        self.assertEqual(len(self.log.read_text().splitlines()), 2)
+        # A different build command invalidates the cache
+        build.build_distributions(self.info, f"true && {self.build_command}")
+        self.assertEqual(len(self.log.read_text().splitlines()), 4)
+
+
+class PushTests(GitRepoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.remote_dir = self.repo_dir.parent / "remote.git"
+        git("init", "--quiet", "--bare", str(self.remote_dir))
+        git("remote", "add", "origin", str(self.remote_dir))
+        git("push", "--quiet", "origin", "dev", "dev:main")
+        self.info = types.SimpleNamespace(
+            name="pkg",
+            version="1.0",
+            confirmation_required=False,
+        )
+
+    def remote_git(self, *args):
+        return git(*args, cwd=self.remote_dir)
+
+    def test_push_release_refs(self):
+        self.write_file("README.md", "# Release\n")
+        git("commit", "--quiet", "-am", "Release")
+        git("branch", "--force", "main")
+        git("tag", "-a", "-m", "Release", "1.0")
+        refs = ["refs/heads/dev", "refs/heads/main", "refs/tags/1.0"]
+        push.push_release_refs(self.info, refs)
+        for ref in refs:
+            self.assertEqual(self.remote_git("rev-parse", ref), git("rev-parse", ref))
+
+    def test_push_is_atomic(self):
+        # Move main on the remote to a commit that local main won't
+        # contain, so pushing main will be rejected as non-fast-forward
+        git("checkout", "--quiet", "-b", "side")
+        self.write_file("README.md", "# Side\n")
+        git("commit", "--quiet", "-am", "Side")
+        git("push", "--quiet", "origin", "side:main")
+        git("checkout", "--quiet", "dev")
+        self.write_file("README.md", "# Release\n")
+        git("commit", "--quiet", "-am", "Release")
+        git("branch", "main")
+        git("tag", "1.0")
+        refs = ["refs/heads/dev", "refs/heads/main", "refs/tags/1.0"]
+        with self.assertRaises(Result):
+            push.push_release_refs(self.info, refs)
+        self.assertNotEqual(
+            self.remote_git("rev-parse", "refs/heads/dev"), git("rev-parse", "dev")
+        )
+        self.assertNotIn("1.0", self.remote_git("tag"))
+
+
+class BenchmarkTests(GitRepoTestCase):
+    def setUp(self):
+        super().setUp()
+        git("tag", "pkg-1.0")
+        self.info = types.SimpleNamespace(
+            name="pkg",
+            version="1.1",
+            tag_name="pkg-1.0",
+            confirmation_required=False,
+        )
+
+    def make_results(self, time):
+        return {
+            "commit": "abc",
+            "benchmarks": {
+                "benchmarks.bench_a": {
+                    "mean": time,
+                    "stdev": 0.001,
+                    "min": time,
+                    "max": time,
+                    "repetitions": 10,
+                    "samples": [time] * 10,
+                }
+            },
+        }
+
+    def make_command(self, *times):
+        """Make command that writes the next result on each run."""
+        temp_dir = self.repo_dir.parent
+        for i, time in enumerate(times):
+            path = temp_dir / f"results-{i}.json"
+            path.write_text(json.dumps(self.make_results(time)))
+        counter = temp_dir / "counter"
+        counter.write_text("0")
+        return (
+            f"n=$(cat {counter}); echo $(((n + 1) % {len(times)})) > {counter}; "
+            f"cp {temp_dir}/results-$n.json {{output}}"
+        )
+
+    def make_baseline(self, *times):
+        return {"benchmarks": {"benchmarks.bench_a": {"runs": list(times)}}}
+
+    def test_skipped_without_benchmarks(self):
+        self.assertIsNone(benchmark.run_benchmarks(self.info))
+
+    def test_no_baseline(self):
+        command = self.make_command(1.0, 1.1, 1.2)
+        self.assertEqual(
+            benchmark.run_benchmarks(self.info, command, tag_prefix="pkg-"),
+            self.make_baseline(1.0, 1.1, 1.2),
+        )
+
+    def test_regression_aborts(self):
+        benchmark.record_baseline(self.info, self.make_baseline(1.0, 1.0, 1.0))
+        self.assertEqual(
+            benchmark.read_baseline("pkg-1.0"), self.make_baseline(1.0, 1.0, 1.0)
+        )
+        command = self.make_command(1.05)
+        benchmark.run_benchmarks(self.info, command, tag_prefix="pkg-")
+        command = self.make_command(1.5)
+        with self.assertRaises(RunAborted):
+            benchmark.run_benchmarks(self.info, command, tag_prefix="pkg-")
+
+    def test_slowdown_must_show_up_in_every_run(self):
+        benchmark.record_baseline(self.info, self.make_baseline(1.0, 1.0, 1.0))
+        command = self.make_command(1.5, 1.0, 1.5)
+        benchmark.run_benchmarks(self.info, command, tag_prefix="pkg-")
+
+    def test_baseline_is_fetched_from_remote(self):
+        remote_dir = self.repo_dir.parent / "remote.git"
+        git("init", "--quiet", "--bare", str(remote_dir))
+        git("remote", "add", "origin", str(remote_dir))
+        git("push", "--quiet", "origin", "dev", "pkg-1.0")
+        # Record a baseline in another clone and push it
+        clone_dir = self.repo_dir.parent / "clone"
+        git("clone", "--quiet", str(remote_dir), str(clone_dir))
+        git("config", "user.name", "Test", cwd=clone_dir)
+        git("config", "user.email", "test@example.com", cwd=clone_dir)
+        git(
+            "notes",
+            "--ref",
+            benchmark.NOTES_REF,
+            "add",
+            "-m",
+            json.dumps(self.make_baseline(1.0, 1.0, 1.0)),
+            "pkg-1.0",
+            cwd=clone_dir,
+        )
+        git("push", "--quiet", "origin", benchmark.NOTES_REF, cwd=clone_dir)
+
+        command = self.make_command(1.5)
+        with self.assertRaises(RunAborted):
+            benchmark.run_benchmarks(
+                self.info, command, tag_prefix="pkg-", remote="origin"
+            )
+
+        # Recording and pushing a new baseline builds on the remote's
+        results = benchmark.run_benchmarks(
+            self.info, self.make_command(1.0), tag_prefix="pkg-", remote="origin"
+        )
+        self.write_file("README.md", "# Release\n")
+        git("commit", "--quiet", "-am", "Release")
+        git("tag", "pkg-1.1")
+        self.info.tag_name = "pkg-1.1"
+        benchmark.record_baseline(self.info, results)
+        refs = ["refs/heads/dev", "refs/tags/pkg-1.1", benchmark.NOTES_REF]
+        push.push_release_refs(self.info, refs)
+        self.assertEqual(
+            git("rev-parse", benchmark.NOTES_REF, cwd=remote_dir),
+            git("rev-parse", benchmark.NOTES_REF),
+        )
+        notes = git("notes", "--ref", benchmark.NOTES_REF, "list", cwd=remote_dir)
+        self.assertEqual(len(notes.splitlines()), 2)
+
+
+PASSING_TEST_MODULE = """\
+import unittest
+
+
+class Tests(unittest.TestCase):
+    def test(self):
+        self.assertTrue(True)
+"""
+
+
+FAILING_TEST_MODULE = PASSING_TEST_MODULE.replace("True)", "False)")